@@ -1,147 +1,310 @@
-from flask import Flask, render_template, Response, jsonify
-import cv2
+import math
+import os
 import threading
 import time
-import numpy as np  # Add this import for np
+from urllib.parse import urlparse
+from flask import Flask, render_template, Response, jsonify, request, abort
 from emotion_detector import EmotionDetector
 from music_player import MusicPlayer
+from inference_pool import ThreadInferencePool, ProcessInferencePool
+from session_manager import SessionManager
+from ingest_batcher import IngestBatcher, parse_frames, result_json
+from metrics import registry
+from profiler import SamplingProfiler
 import config
 
 app = Flask(__name__)
+# Checked by Werkzeug before reading a body with a Content-Length; chunked
+# bodies are cut off at the limit instead (see ingest)
+app.config['MAX_CONTENT_LENGTH'] = getattr(config, 'INGEST_MAX_BYTES', 2 * 1024 * 1024)
+started_at = time.time()
 
-# Initialize components
-emotion_detector = EmotionDetector()
-music_player = MusicPlayer(
-    client_id=config.SPOTIFY_CLIENT_ID,
-    client_secret=config.SPOTIFY_CLIENT_SECRET,
-    redirect_uri=config.SPOTIFY_REDIRECT_URI
-)
-
-# Global variables
-camera = None
-current_emotion = "neutral"
-current_track = None
-emotion_lock = threading.Lock()
-detection_thread = None
-detection_active = False
-
-def init_camera():
-    global camera
-    camera = cv2.VideoCapture(config.CAMERA_INDEX)
-    
-def release_camera():
-    global camera
-    if camera is not None:
-        camera.release()
-        camera = None
-
-def detect_emotion_thread():
-    global current_emotion, detection_active
-    
-    while detection_active:
-        if camera is None:
-            time.sleep(1)
-            continue
-        
-        # Capture frame
-        ret, frame = camera.read()
-        if not ret:
-            continue
-        
-        # Detect emotion
-        emotion, _ = emotion_detector.detect_emotion(frame)
-        
-        if emotion:
-            with emotion_lock:
-                # Only update if emotion is different
-                if emotion != current_emotion:
-                    current_emotion = emotion
-                    # Play appropriate music
-                    play_music_for_current_emotion()
-        
-        # Wait before next detection
-        time.sleep(config.EMOTION_DETECTION_INTERVAL)
-
-def play_music_for_current_emotion():
-    global current_track
-    with emotion_lock:
-        # Get a track matching the current emotion
-        track_info = music_player.play_random_track_for_emotion(current_emotion)
-        if track_info:
-            current_track = track_info
-
-def generate_frames():
-    while True:
-        if camera is None:
-            # Return a blank frame if camera not initialized
-            blank_frame = 255 * np.ones(shape=[480, 640, 3], dtype=np.uint8)
-            _, buffer = cv2.imencode('.jpg', blank_frame)
-            frame = buffer.tobytes()
-            yield (b'--frame\r\n'
-                  b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
-            time.sleep(0.1)
-            continue
-            
-        success, frame = camera.read()
-        if not success:
-            break
-        
-        # Get current emotion to display
-        with emotion_lock:
-            emotion_to_display = current_emotion
-        
-        # Draw emotion on frame
-        if emotion_to_display:
-            # Detect face again just to get coordinates
-            _, face_coords = emotion_detector.detect_emotion(frame)
-            frame = emotion_detector.draw_emotion_on_frame(frame, emotion_to_display, face_coords)
-        
-        # Convert to JPEG
-        ret, buffer = cv2.imencode('.jpg', frame)
-        frame = buffer.tobytes()
-        
-        # Yield the frame in the response
-        yield (b'--frame\r\n'
-               b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
+def create_components():
+    """
+    Build the models, players and sessions. Nothing here blocks on the
+    network or on loading the emotion model: both happen on background
+    threads while the server starts, and /health reports when they are ready.
+    """
+    global detector_kwargs, inference_pool, emotion_detector, player_options, music_player
+    global DEFAULT_SESSION, session_manager, ingest_batcher, profiler
+    detector_kwargs = {
+        "face_detector": getattr(config, 'FACE_DETECTOR', 'haar'),
+        "face_detector_options": dict(getattr(config, 'FACE_DETECTOR_OPTIONS', {}),
+                                      downscale=getattr(config, 'FACE_DETECTOR_DOWNSCALE', 1.0)),
+        "emotion_backend": getattr(config, 'EMOTION_BACKEND', 'deepface'),
+        "emotion_model_path": getattr(config, 'EMOTION_MODEL_PATH', None),
+        "emotion_threads": getattr(config, 'EMOTION_THREADS', None)
+    }
+    if getattr(config, 'INFERENCE_PROCESSES', 0):
+        # Fork the inference workers first, before TensorFlow or any threads exist.
+        # The web process itself then only needs face detection and drawing.
+        inference_pool = ProcessInferencePool(
+            processes=config.INFERENCE_PROCESSES,
+            max_age=getattr(config, 'INFERENCE_MAX_FRAME_AGE', 0.5),
+            detector_kwargs=detector_kwargs
+        )
+        emotion_detector = EmotionDetector(load_model=False, **detector_kwargs)
+    else:
+        emotion_detector = EmotionDetector(background=True, **detector_kwargs)
+        inference_pool = ThreadInferencePool(emotion_detector, workers=getattr(config, 'INFERENCE_WORKERS', 2))
+
+    player_options = dict(
+        client_id=config.SPOTIFY_CLIENT_ID,
+        client_secret=config.SPOTIFY_CLIENT_SECRET,
+        redirect_uri=config.SPOTIFY_REDIRECT_URI,
+        track_cache_ttl=getattr(config, 'TRACK_CACHE_TTL', 600.0),
+        track_pool_size=getattr(config, 'TRACK_POOL_SIZE', 200),
+        library_cache_path=getattr(config, 'LIBRARY_CACHE_PATH', '.spotify_library.json'),
+        sync_workers=getattr(config, 'LIBRARY_SYNC_WORKERS', 4),
+        library_full_sync_interval=getattr(config, 'LIBRARY_FULL_SYNC_INTERVAL', 86400.0),
+        track_index_path=getattr(config, 'TRACK_INDEX_PATH', '.track_index.db'),
+        token_cache_path=getattr(config, 'SPOTIFY_TOKEN_CACHE', '.spotify_cache'),
+        http_pool_size=getattr(config, 'SPOTIFY_HTTP_POOL_SIZE', 10),
+        request_timeout=getattr(config, 'SPOTIFY_REQUEST_TIMEOUT', 5.0),
+        rate_limit=getattr(config, 'SPOTIFY_RATE_LIMIT', 10.0),
+        rate_burst=getattr(config, 'SPOTIFY_RATE_BURST', 20),
+        max_retry_after=getattr(config, 'SPOTIFY_MAX_RETRY_AFTER', 30.0),
+        api_url=getattr(config, 'SPOTIFY_API_URL', None),
+        access_token=getattr(config, 'SPOTIFY_ACCESS_TOKEN', None),
+        queue_length=getattr(config, 'PLAYBACK_QUEUE_LENGTH', 5),
+        queue_check_interval=getattr(config, 'PLAYBACK_CHECK_INTERVAL', 30.0),
+        device_cache_ttl=getattr(config, 'DEVICE_CACHE_TTL', 300.0),
+        login_via_app=oauth_redirect_is_served()
+    )
+    music_player = MusicPlayer(background=True, **player_options)
+
+    # One pipeline per camera, all sharing the emotion model and a bounded
+    # pool of inference workers
+    camera_sources = getattr(config, 'SESSIONS', {"default": config.CAMERA_INDEX})
+    DEFAULT_SESSION = next(iter(camera_sources))
+    session_manager = SessionManager(
+        camera_sources,
+        emotion_detector,
+        inference_pool,
+        player_for_session,
+        config
+    )
+
+    # Frames uploaded by browser cameras are analysed in batches across clients;
+    # with worker processes the model lives in the workers, so they get the frames
+    ingest_batcher = IngestBatcher(
+        emotion_detector,
+        max_batch=getattr(config, 'INGEST_MAX_BATCH', 64),
+        max_wait=getattr(config, 'INGEST_MAX_WAIT', 0.01),
+        max_pending=getattr(config, 'INGEST_MAX_PENDING', 512),
+        fallback_pool=inference_pool if getattr(config, 'INFERENCE_PROCESSES', 0) else None,
+        max_detectors=getattr(config, 'INGEST_MAX_DETECTORS', 8),
+        max_dimension=getattr(config, 'INGEST_MAX_DIMENSION', 1920)
+    )
+
+    # Sampling profiler, only reachable when PROFILER_ENABLED is set
+    profiler = SamplingProfiler(interval=getattr(config, 'PROFILER_INTERVAL', 0.01))
+
+def oauth_redirect_is_served():
+    """Whether SPOTIFY_REDIRECT_URI points at this app's /callback route"""
+    redirect = urlparse(config.SPOTIFY_REDIRECT_URI)
+    return redirect.port == config.PORT and redirect.path == '/callback'
+
+# Sessions with player options of their own in SESSIONS get their own
+# MusicPlayer, with its own playback queue and library files; the others
+# share music_player. A Spotify account plays on one device at a time, so
+# rooms only play independently with their own login (token_cache_path)
+session_players = {}
+session_players_lock = threading.Lock()
+
+def player_for_session(session_id, options):
+    if not options:
+        return music_player
+    with session_players_lock:
+        player = session_players.get(session_id)
+        if player is None:
+            kwargs = dict(
+                player_options,
+                library_cache_path=f".spotify_library_{session_id}.json",
+                track_index_path=f".track_index_{session_id}.db"
+            )
+            kwargs.update(options)
+            player = session_players[session_id] = MusicPlayer(background=True, **kwargs)
+        return player
+
+def is_reloader_parent():
+    """
+    With DEBUG, app.run() keeps this process only to watch for code changes
+    and serves requests from a child process it restarts on each change
+    """
+    return __name__ == '__main__' and config.DEBUG and os.environ.get('WERKZEUG_RUN_MAIN') != 'true'
+
+# Inference workers started with spawn (Windows) run the main script again
+# as __mp_main__ before starting, and the reloader parent never serves;
+# only the serving process builds the components
+if __name__ != '__mp_main__' and not is_reloader_parent():
+    create_components()
+
+def get_session():
+    session = session_manager.get(request.args.get('session', DEFAULT_SESSION))
+    if session is None:
+        abort(404)
+    return session
 
 @app.route('/')
 def index():
-    return render_template('index.html')
+    session_id = request.args.get('session', DEFAULT_SESSION)
+    return render_template(
+        'index.html',
+        session_id=session_id,
+        browser_camera=session_manager.is_browser_camera(session_id),
+        ingest_width=getattr(config, 'INGEST_FRAME_WIDTH', 320),
+        ingest_fps=getattr(config, 'INGEST_FPS', 4),
+        ingest_batch=getattr(config, 'INGEST_BATCH_FRAMES', 4)
+    )
 
 @app.route('/video_feed')
 def video_feed():
-    return Response(generate_frames(),
+    return Response(get_session().generate_frames(),
                    mimetype='multipart/x-mixed-replace; boundary=frame')
 
 @app.route('/start_detection')
 def start_detection():
-    global detection_thread, detection_active
+    try:
+        started = get_session().start_detection()
+    except IOError as e:
+        # The feed keeps showing the placeholder
+        return jsonify({"status": "camera_unavailable", "error": str(e)}), 503
     
-    if detection_thread is None or not detection_thread.is_alive():
-        init_camera()
-        detection_active = True
-        detection_thread = threading.Thread(target=detect_emotion_thread)
-        detection_thread.daemon = True
-        detection_thread.start()
+    if started:
         return jsonify({"status": "started"})
     
     return jsonify({"status": "already_running"})
 
 @app.route('/stop_detection')
 def stop_detection():
-    global detection_active
-    
-    detection_active = False
-    release_camera()
+    get_session().stop_detection()
     return jsonify({"status": "stopped"})
 
+@app.route('/ingest', methods=['POST'])
+def ingest():
+    session = get_session()
+    # Only browser camera sessions take uploads, and only while detection
+    # runs; checked before decoding anything
+    if not session.browser_camera:
+        return jsonify({"error": "session does not use a browser camera"}), 400
+    if not session.is_running():
+        return jsonify({"status": "stopped"}), 409
+    
+    interval = request.args.get('interval', 0.0, type=float)
+    if not math.isfinite(interval):
+        return jsonify({"error": "interval must be a number of seconds"}), 400
+    # Frames further apart than this are timestamped as if they weren't
+    interval = min(max(interval, 0.0), getattr(config, 'INGEST_MAX_INTERVAL', 5.0))
+    
+    # Length-prefixed JPEG frames from the browser camera, oldest first.
+    # Reading on from a chunked body that filled MAX_CONTENT_LENGTH raises 413
+    data = request.get_data()
+    request.stream.read(1)
+    try:
+        frames = parse_frames(data, getattr(config, 'INGEST_MAX_FRAMES', 16))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    results = ingest_batcher.analyze(frames)
+    if results is None:
+        # Model still loading or too many faces queued; the client sends newer frames soon
+        return jsonify({"status": "busy"}), 503
+    
+    session.ingest(results, interval=interval)
+    return jsonify({
+        "results": [result_json(result) for result in results],
+        "emotion": session.current_emotion
+    })
+
+@app.route('/callback')
+def spotify_callback():
+    # Spotify sends the browser here (SPOTIFY_REDIRECT_URI) after logging in;
+    # the state says which player started the login
+    with session_players_lock:
+        players = [music_player, *session_players.values()]
+    for player in players:
+        if player.complete_login(request.args.get('state'), request.args.get('code'), request.args.get('error')):
+            if request.args.get('error'):
+                return "Spotify login failed, music will play without playback control."
+            return "Logged in to Spotify, you can close this tab."
+    abort(400)
+
+@app.route('/events')
+def events():
+    session = get_session()
+    
+    # Browsers send Last-Event-ID when reconnecting, so clients only get a
+    # message if something changed while they were away
+    try:
+        last_version = int(request.headers.get('Last-Event-ID', -1))
+    except ValueError:
+        last_version = -1
+    
+    return Response(session.generate_events(last_version),
+                   mimetype='text/event-stream',
+                   headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/current_info')
 def current_info():
-    with emotion_lock:
-        return jsonify({
-            "emotion": current_emotion,
-            "track": current_track
-        })
+    session = get_session()
+    with session.emotion_lock:
+        return jsonify(session.info())
+
+@app.route('/sessions')
+def sessions():
+    return jsonify(session_manager.list())
+
+@app.route('/health')
+def health():
+    with session_players_lock:
+        players = [music_player, *session_players.values()]
+    components = {
+        "emotion_model": {"ready": inference_pool.is_ready(), "error": inference_pool.load_error},
+        "spotify": {
+            "ready": all(player.is_ready() for player in players),
+            "playback": music_player.playback_available
+        }
+    }
+    ready = all(component["ready"] for component in components.values())
+    
+    # 503 until everything is loaded, so deploys can wait for readiness
+    return jsonify({
+        "status": "ok" if ready else "starting",
+        "uptime": round(time.time() - started_at, 1),
+        "components": components
+    }), 200 if ready else 503
+
+@app.route('/metrics')
+def metrics():
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+def require_profiler():
+    if not getattr(config, 'PROFILER_ENABLED', False):
+        abort(404)
+
+@app.route('/profile/start')
+def profile_start():
+    require_profiler()
+    interval = request.args.get('interval', type=float)
+    if interval is not None and not (math.isfinite(interval) and interval > 0):
+        return jsonify({"error": "interval must be a positive number of seconds"}), 400
+    started = profiler.start(interval)
+    return jsonify({"status": "started" if started else "already_running"})
+
+@app.route('/profile/stop')
+def profile_stop():
+    require_profiler()
+    profiler.stop()
+    return jsonify(profiler.summary())
+
+@app.route('/profile')
+def profile():
+    require_profiler()
+    # Collapsed stacks for flamegraph.pl or speedscope, or a JSON summary
+    if request.args.get('format') == 'collapsed':
+        return Response(profiler.collapsed(), mimetype='text/plain')
+    return jsonify(profiler.summary())
 
 if __name__ == '__main__':
     app.run(debug=config.DEBUG, port=config.PORT)
\ No newline at end of file
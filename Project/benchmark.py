@@ -0,0 +1,260 @@
+"""
+Offline benchmark for the emotion detection pipeline.
+
+Replays recorded videos and image sequences through the same stages the
+live detector runs (grayscale conversion, face detection, cropping and
+emotion inference) and reports per-stage latency percentiles, throughput,
+peak memory and CPU utilisation as JSON.
+
+Usage:
+    python benchmark.py fixtures/ --stub-model --output bench.json
+    python benchmark.py fixtures/ --stub-model --face-detector haar,lbp --face-downscale 0.5
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+from emotion_detector import EmotionDetector
+
+VIDEO_EXTENSIONS = {".mp4", ".avi", ".mov", ".mkv", ".webm"}
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp"}
+STAGES = ["grayscale", "face_detection", "crop", "inference", "total"]
+
+
+class StubEmotionModel:
+    """
+    Stand-in for the DeepFace emotion classifier so the benchmark can run
+    on machines without the model weights. Returns random probabilities
+    after an optional fixed delay.
+    """
+    def __init__(self, latency_ms=0.0, seed=0):
+        self.latency = latency_ms / 1000.0
+        self.rng = np.random.default_rng(seed)
+
+    def predict_on_batch(self, batch):
+        if self.latency:
+            time.sleep(self.latency)
+        return self.rng.dirichlet(np.ones(7), size=len(batch)).astype(np.float32)
+
+
+def find_sources(paths):
+    """
+    Expand the given paths into a list of (name, kind, target) sources.
+    Video files are replayed as-is, directories of images as one sequence.
+    """
+    sources = []
+    for path in paths:
+        if os.path.isfile(path):
+            ext = os.path.splitext(path)[1].lower()
+            if ext in VIDEO_EXTENSIONS:
+                sources.append((path, "video", path))
+            elif ext in IMAGE_EXTENSIONS:
+                sources.append((path, "images", [path]))
+            continue
+
+        if not os.path.isdir(path):
+            print(f"Skipping missing path: {path}", file=sys.stderr)
+            continue
+
+        images = []
+        for entry in sorted(os.listdir(path)):
+            full_path = os.path.join(path, entry)
+            ext = os.path.splitext(entry)[1].lower()
+            if os.path.isdir(full_path):
+                sources.extend(find_sources([full_path]))
+            elif ext in VIDEO_EXTENSIONS:
+                sources.append((full_path, "video", full_path))
+            elif ext in IMAGE_EXTENSIONS:
+                images.append(full_path)
+
+        if images:
+            sources.append((path, "images", images))
+
+    return sources
+
+
+def iter_frames(kind, target):
+    if kind == "video":
+        capture = cv2.VideoCapture(target)
+        try:
+            while True:
+                ret, frame = capture.read()
+                if not ret:
+                    break
+                yield frame
+        finally:
+            capture.release()
+    else:
+        for image_path in target:
+            frame = cv2.imread(image_path)
+            if frame is not None:
+                yield frame
+
+
+def percentiles(samples):
+    if not samples:
+        return {"count": 0}
+    values = np.asarray(samples) * 1000.0
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        "count": len(samples),
+        "mean_ms": round(float(values.mean()), 3),
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+        "max_ms": round(float(values.max()), 3)
+    }
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is reported in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+def iter_all_frames(sources):
+    for name, kind, target in sources:
+        print(f"Replaying {name}", file=sys.stderr)
+        yield from iter_frames(kind, target)
+
+
+def run_benchmark(detector, sources, max_frames=None, warmup_frames=5):
+    timings = {stage: [] for stage in STAGES}
+    frames = 0
+    faces = 0
+    skipped = 0
+
+    # Both clocks start with the first measured frame, so warm-up time isn't
+    # spread over frames that don't count
+    wall_start = None
+    cpu_start = None
+
+    for frame in iter_all_frames(sources):
+        if max_frames is not None and frames >= max_frames:
+            break
+
+        cpu0 = time.process_time()
+        t0 = time.perf_counter()
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        t1 = time.perf_counter()
+        boxes = detector.detect_faces(gray, frame)
+        t2 = time.perf_counter()
+
+        t3 = t4 = t2
+        if len(boxes) > 0:
+            batch = np.stack([detector.preprocess_face(gray, box) for box in boxes])
+            t3 = time.perf_counter()
+            detector.predict_emotions(batch)
+            t4 = time.perf_counter()
+
+        # Leave the first few frames out of the statistics so one-off
+        # allocations and lazy initialisation don't skew the tail
+        if skipped < warmup_frames:
+            skipped += 1
+            continue
+
+        if wall_start is None:
+            wall_start = t0
+            cpu_start = cpu0
+        frames += 1
+        faces += len(boxes)
+        timings["grayscale"].append(t1 - t0)
+        timings["face_detection"].append(t2 - t1)
+        if len(boxes) > 0:
+            timings["crop"].append(t3 - t2)
+            timings["inference"].append(t4 - t3)
+        timings["total"].append(t4 - t0)
+
+    wall = time.perf_counter() - wall_start if wall_start is not None else 0.0
+    cpu = time.process_time() - cpu_start if cpu_start is not None else 0.0
+    peak_rss = peak_rss_mb()
+
+    return {
+        "frames": frames,
+        "faces": faces,
+        "wall_seconds": round(wall, 3),
+        "fps": round(frames / wall, 2) if wall > 0 else 0.0,
+        "cpu_percent": round(100.0 * cpu / wall, 1) if wall > 0 else 0.0,
+        "peak_rss_mb": round(peak_rss, 1) if peak_rss is not None else None,
+        "stages": {stage: percentiles(timings[stage]) for stage in STAGES},
+        "face_detector": detector.face_backend.stats()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the emotion detection pipeline on recorded video")
+    parser.add_argument("inputs", nargs="+", help="Video files, images or directories of them")
+    parser.add_argument("--stub-model", action="store_true", help="Use a random stub instead of the DeepFace model")
+    parser.add_argument("--stub-latency", type=float, default=0.0, help="Simulated inference time in ms for the stub model")
+    parser.add_argument("--max-frames", type=int, default=None, help="Stop after this many measured frames")
+    parser.add_argument("--warmup-frames", type=int, default=5, help="Frames to run before measuring")
+    parser.add_argument("--emotion-backend", default="deepface", choices=["deepface", "onnx"],
+                        help="Emotion model backend to benchmark")
+    parser.add_argument("--emotion-model", help="Path of the ONNX emotion model for --emotion-backend onnx")
+    parser.add_argument("--face-detector", default="haar",
+                        help="Face detector backend, or a comma separated list to compare (haar, lbp, dnn)")
+    parser.add_argument("--face-downscale", type=float, default=1.0, help="Scale frames by this factor before face detection")
+    parser.add_argument("--face-options", default="{}",
+                        help='JSON options per face detector, e.g. \'{"lbp": {"path": "lbpcascade.xml"}}\'')
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout")
+    args = parser.parse_args()
+
+    sources = find_sources(args.inputs)
+    if not sources:
+        parser.error("no video files or images found")
+
+    face_options = json.loads(args.face_options)
+    face_detectors = [name.strip() for name in args.face_detector.split(",") if name.strip()]
+
+    # Time model loading on its own, it dominates startup with the DeepFace backend
+    load_start = time.perf_counter()
+    if args.stub_model:
+        model = StubEmotionModel(args.stub_latency)
+    else:
+        model = EmotionDetector(load_model=False, emotion_backend=args.emotion_backend,
+                                emotion_model_path=args.emotion_model).build_model()
+    model_load_seconds = time.perf_counter() - load_start
+
+    runs = {}
+    for face_detector in face_detectors:
+        # One backend failing (e.g. a missing cascade file) keeps the others' results
+        try:
+            detector = EmotionDetector(model=model, background=False, face_detector=face_detector,
+                                       face_detector_options=dict(face_options.get(face_detector, {}),
+                                                                  downscale=args.face_downscale))
+            runs[face_detector] = run_benchmark(detector, sources, args.max_frames, args.warmup_frames)
+        except Exception as e:
+            print(f"Benchmark with face detector {face_detector} failed: {e}", file=sys.stderr)
+            runs[face_detector] = {"error": str(e)}
+
+    report = runs[face_detectors[0]] if len(runs) == 1 else {"runs": runs}
+    report["model"] = "stub" if args.stub_model else args.emotion_backend
+    report["model_load_seconds"] = round(model_load_seconds, 3)
+    report["sources"] = [name for name, _, _ in sources]
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+        print(f"Wrote benchmark report to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+import cv2
+import numpy as np
+
+
+class BoxTracker:
+    """
+    Moves a face box between detections using sparse optical flow.
+    Points inside the box are tracked from frame to frame and the box is
+    shifted by their median displacement, which is far cheaper than
+    running face detection again.
+    """
+    def __init__(self, scale=0.5, max_points=30, min_points=5):
+        self.scale = scale
+        self.max_points = max_points
+        self.min_points = min_points
+
+        self.prev_gray = None
+        self.points = None
+        self.box = None
+
+    def reset(self, gray, box):
+        """Anchor the tracker on a freshly detected box"""
+        if box is None:
+            self.prev_gray = None
+            self.points = None
+            self.box = None
+            return
+
+        self.box = tuple(int(v) for v in box)
+        self.prev_gray = self._downscale(gray)
+        self.points = self._find_points(self.prev_gray, self.box)
+
+    def update(self, gray):
+        """
+        Track the box into a new grayscale frame
+        Returns: the updated box, or None if nothing is being tracked
+        """
+        if self.box is None:
+            return None
+
+        small = self._downscale(gray)
+
+        if self.points is None or len(self.points) < self.min_points:
+            # Nothing to follow, keep the last box and try to pick up texture again
+            self.prev_gray = small
+            self.points = self._find_points(small, self.box)
+            return self.box
+
+        new_points, status, _ = cv2.calcOpticalFlowPyrLK(
+            self.prev_gray, small, self.points, None, winSize=(15, 15), maxLevel=2
+        )
+        good = status.reshape(-1) == 1
+        old_good = self.points[good]
+        new_good = new_points[good]
+
+        if len(new_good) >= self.min_points:
+            dx, dy = np.median((new_good - old_good).reshape(-1, 2), axis=0) / self.scale
+            x, y, w, h = self.box
+            self.box = (int(round(x + dx)), int(round(y + dy)), w, h)
+            self.points = new_good.reshape(-1, 1, 2)
+        else:
+            self.points = None
+
+        self.prev_gray = small
+        return self.box
+
+    def _downscale(self, gray):
+        if self.scale == 1.0:
+            return gray
+        return cv2.resize(gray, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+
+    def _find_points(self, small, box):
+        x, y, w, h = (int(v * self.scale) for v in box)
+        mask = np.zeros_like(small)
+        mask[max(y, 0):max(y + h, 0), max(x, 0):max(x + w, 0)] = 255
+        return cv2.goodFeaturesToTrack(small, self.max_points, 0.01, 3, mask=mask)
@@ -0,0 +1,107 @@
+import cv2
+import numpy as np
+import time
+
+
+class DetectionScheduler:
+    """
+    Decides when the expensive emotion model should run.
+
+    A tiny grayscale thumbnail of each frame is compared with the one from
+    the last analysis. Inference runs when the scene changed, when the last
+    result was uncertain, or when the last result is older than
+    max_staleness. While the face stays still (or no face is present) the
+    re-check interval backs off towards max_interval.
+    """
+    def __init__(self, min_interval=0.2, max_interval=2.0, max_staleness=5.0,
+                 scene_threshold=6.0, motion_threshold=0.15, confidence_threshold=0.5,
+                 backoff=1.5, thumbnail_size=(64, 48)):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.max_staleness = max_staleness
+        self.scene_threshold = scene_threshold
+        self.motion_threshold = motion_threshold
+        self.confidence_threshold = confidence_threshold
+        self.backoff = backoff
+        self.thumbnail_size = thumbnail_size
+
+        self.reset()
+
+    @property
+    def poll_interval(self):
+        """How long the caller should wait before asking again after a skip"""
+        return self.min_interval / 2
+
+    def reset(self):
+        self.interval = self.min_interval
+        self.last_run = 0.0
+        self.last_thumbnail = None
+        self.last_face_coords = None
+        self.last_emotion = None
+        self.last_confidence = 0.0
+
+    def thumbnail(self, frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        return cv2.resize(gray, self.thumbnail_size, interpolation=cv2.INTER_AREA)
+
+    def scene_score(self, thumbnail):
+        """Mean absolute pixel difference against the last analysed frame"""
+        if self.last_thumbnail is None:
+            return float("inf")
+        return float(cv2.absdiff(thumbnail, self.last_thumbnail).mean())
+
+    def should_run(self, frame, now=None):
+        """
+        Whether the emotion model should run on this frame
+        """
+        now = time.time() if now is None else now
+        elapsed = now - self.last_run
+
+        if self.last_thumbnail is None:
+            return True
+        if elapsed < self.min_interval:
+            return False
+        if elapsed >= self.max_staleness:
+            return True
+
+        if self.scene_score(self.thumbnail(frame)) >= self.scene_threshold:
+            # React straight away when something actually changed
+            self.interval = self.min_interval
+            return True
+
+        if self.last_face_coords is not None and self.last_confidence < self.confidence_threshold:
+            return elapsed >= self.interval
+
+        return False
+
+    def record(self, frame, emotion, face_coords, confidence, now=None):
+        """
+        Feed back the result of an analysis to adapt the interval
+        """
+        now = time.time() if now is None else now
+
+        motion = self.box_motion(self.last_face_coords, face_coords)
+        if face_coords is not None and (motion > self.motion_threshold or emotion != self.last_emotion):
+            self.interval = self.min_interval
+        else:
+            # Stable face or empty scene: check less and less often
+            self.interval = min(self.interval * self.backoff, self.max_interval)
+
+        self.last_run = now
+        self.last_thumbnail = self.thumbnail(frame)
+        self.last_face_coords = face_coords
+        self.last_emotion = emotion
+        self.last_confidence = confidence
+
+    @staticmethod
+    def box_motion(previous, current):
+        """
+        Displacement of the face box centre relative to its size
+        """
+        if previous is None or current is None:
+            return 0.0 if previous is current else float("inf")
+
+        px, py, pw, ph = previous
+        cx, cy, cw, ch = current
+        shift = np.hypot((cx + cw / 2) - (px + pw / 2), (cy + ch / 2) - (py + ph / 2))
+        return float(shift / max(pw, ph, 1))
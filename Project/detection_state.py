@@ -0,0 +1,43 @@
+import threading
+import time
+
+
+class DetectionResult:
+    """
+    Outcome of one emotion detection pass over a frame
+    """
+    __slots__ = ("emotion", "face_coords", "confidence", "frame_seq", "timestamp", "probabilities")
+
+    def __init__(self, emotion, face_coords, confidence, frame_seq, timestamp=None, probabilities=None):
+        self.emotion = emotion
+        self.face_coords = face_coords
+        self.confidence = confidence
+        self.frame_seq = frame_seq
+        self.probabilities = probabilities
+        self.timestamp = timestamp if timestamp is not None else time.time()
+
+
+class DetectionState:
+    """
+    Latest detection result, written by the detection thread and read by
+    any number of stream clients without running inference themselves.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.result = None
+        self.version = 0
+
+    def publish(self, result):
+        with self.lock:
+            self.result = result
+            self.version += 1
+
+    def latest(self):
+        """Return (version, result); result is None until the first detection"""
+        with self.lock:
+            return self.version, self.result
+
+    def clear(self):
+        with self.lock:
+            self.result = None
+            self.version += 1
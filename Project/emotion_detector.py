@@ -1,43 +1,229 @@
 import cv2
-from deepface import DeepFace
 import numpy as np
+import threading
+import time
+from face_backends import create_face_backend
+from metrics import registry
+
+EMOTION_INFERENCE_SECONDS = registry.histogram("emotion_inference_seconds",
+                                               "Time for one batched emotion model forward pass", ["backend"])
+FACES_ANALYSED = registry.counter("faces_analysed_total", "Faces classified by the emotion model", ["backend"])
 
 class EmotionDetector:
-    def __init__(self):
-        # Load the face cascade for detecting faces
-        self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+    # Input size of the DeepFace emotion classifier
+    face_size = 48
+    
+    def __init__(self, model=None, warm_up=True, background=True, load_model=True,
+                 face_detector="haar", face_detector_options=None,
+                 emotion_backend="deepface", emotion_model_path=None, emotion_threads=None):
+        # Load the face detector backend (Haar cascade by default)
+        self.face_detector = face_detector
+        self.face_detector_options = dict(face_detector_options or {})
+        self.face_backend = create_face_backend(face_detector, **self.face_detector_options)
         self.emotions = ["angry", "disgust", "fear", "happy", "sad", "surprise", "neutral"]
+        self.emotion_backend = emotion_backend
+        self.emotion_model_path = emotion_model_path
+        self.emotion_threads = emotion_threads
+        # Stage durations of the last detect_emotions() call, for callers in
+        # other processes that can't see this process's metrics
+        self.last_timings = {}
         
+        # Build the emotion classifier once instead of on every analyze() call.
+        # Any object with a Keras-style predict_on_batch() can be passed in.
+        # With load_model=False only face detection and drawing are available,
+        # e.g. when inference runs in separate worker processes. With
+        # background=True the model is loaded and warmed up on a separate
+        # thread; is_ready() reports when it can be used.
+        self.ready_event = threading.Event()
+        self.load_error = None
+        self.model = model
+        
+        if model is not None or load_model:
+            if background:
+                load_thread = threading.Thread(target=self.load_in_background, args=(warm_up,),
+                                               name="emotion-model")
+                load_thread.daemon = True
+                load_thread.start()
+            else:
+                self.load(warm_up)
+    
+    def load(self, warm_up=True):
+        """Build the emotion model if none was given, then optionally warm it up"""
+        if self.model is None:
+            start = time.time()
+            self.model = self.build_model()
+            print(f"Loaded {self.emotion_backend} emotion model in {time.time() - start:.1f}s")
+        
+        if warm_up:
+            self.warm_up()
+        else:
+            self.ready_event.set()
+    
+    def load_in_background(self, warm_up=True):
+        try:
+            self.load(warm_up)
+        except Exception as e:
+            self.load_error = str(e)
+            print(f"Error loading emotion model: {e}")
+    
+    def build_model(self):
+        """Load the emotion classifier for the configured backend ("deepface" or "onnx")"""
+        if self.emotion_backend == "onnx":
+            # No TensorFlow import at all on this path
+            from onnx_emotion import OnnxEmotionModel
+            return OnnxEmotionModel(self.emotion_model_path or "models/emotion_int8.onnx", self.emotion_threads)
+        if self.emotion_backend != "deepface":
+            raise ValueError(f"Unknown emotion backend '{self.emotion_backend}', expected deepface or onnx")
+
+        from deepface import DeepFace
+        return DeepFace.build_model("Emotion")
+    
+    def warm_up(self):
+        """
+        Run a dummy inference so the first real frame doesn't pay for
+        graph tracing and weight loading
+        """
+        try:
+            dummy = np.zeros((1, self.face_size, self.face_size, 1), dtype=np.float32)
+            self.model.predict_on_batch(dummy)
+        except Exception as e:
+            print(f"Error warming up emotion model: {e}")
+        finally:
+            self.ready_event.set()
+    
+    def is_ready(self):
+        """Whether the emotion model is loaded and warmed up"""
+        return self.ready_event.is_set()
+    
+    def preprocess_face(self, gray, face_coords):
+        """
+        Crop a face from a grayscale frame and scale it to the model input
+        Returns: array of shape (48, 48, 1) with values in [0, 1]
+        """
+        x, y, w, h = face_coords
+        face = cv2.resize(gray[y:y+h, x:x+w], (self.face_size, self.face_size))
+        return (face.astype(np.float32) / 255.0)[:, :, np.newaxis]
+    
+    def predict_emotions(self, batch):
+        """
+        Run the emotion classifier on a batch of preprocessed faces
+        Returns: array of shape (N, 7) of probabilities in the order of self.emotions
+        """
+        start = time.perf_counter()
+        predictions = np.asarray(self.model.predict_on_batch(batch), dtype=np.float32)
+        elapsed = time.perf_counter() - start
+        EMOTION_INFERENCE_SECONDS.observe(elapsed, backend=self.emotion_backend)
+        FACES_ANALYSED.inc(len(batch), backend=self.emotion_backend)
+        self.last_timings['inference'] = elapsed
+        
+        totals = predictions.sum(axis=1, keepdims=True)
+        totals[totals == 0] = 1.0
+        return predictions / totals
+        
+    def detect_faces(self, gray, frame=None, roi=None):
+        """
+        Find faces in a grayscale frame, optionally searching around a known face first
+        Returns: sequence of (x, y, w, h) boxes
+        """
+        return self.face_backend.detect(gray, frame, roi)
+    
     def detect_emotion(self, frame):
         """
         Detect emotion from a video frame
         Returns: dominant emotion and face coordinates
         """
+        emotion, face_coords, _ = self.analyze_frame(frame)
+        return emotion, face_coords
+    
+    def analyze_frame(self, frame):
+        """
+        Detect emotion from a video frame
+        Returns: dominant emotion, face coordinates and confidence (0-1)
+        """
         # Convert to grayscale
         gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
         
         # Detect faces
-        faces = self.face_cascade.detectMultiScale(gray, 1.1, 4)
+        faces = self.detect_faces(gray, frame)
         
         if len(faces) == 0:
-            return None, None
+            return None, None, 0.0
         
         # For the first face detected
         x, y, w, h = faces[0]
         
-        # Extract the face
-        face_img = frame[y:y+h, x:x+w]
-        
         try:
-            # Analyze emotion using DeepFace
-            result = DeepFace.analyze(face_img, actions=['emotion'], enforce_detection=False)
+            # Classify the cropped grayscale face directly with the preloaded model
+            batch = self.preprocess_face(gray, (x, y, w, h))[np.newaxis]
+            probabilities = self.predict_emotions(batch)[0]
             
             # Get the dominant emotion
-            emotion = result[0]['dominant_emotion']
-            return emotion, (x, y, w, h)
+            index = int(np.argmax(probabilities))
+            return self.emotions[index], (x, y, w, h), float(probabilities[index])
         except Exception as e:
             print(f"Error in emotion detection: {e}")
-            return None, (x, y, w, h)
+            return None, (x, y, w, h), 0.0
+    
+    def detect_emotions(self, frame, roi=None):
+        """
+        Detect the emotion of every face in a video frame using a single
+        batched forward pass
+        Returns: list of per-face results and the aggregated room mood
+        """
+        self.last_timings = {}
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        faces = self.detect_faces(gray, frame, roi)
+        self.last_timings['face_detection'] = self.face_backend.timings[-1]
+        
+        if len(faces) == 0:
+            return [], None
+        
+        face_boxes = [tuple(int(v) for v in face) for face in faces]
+        
+        try:
+            batch = np.stack([self.preprocess_face(gray, box) for box in face_boxes])
+            probabilities = self.predict_emotions(batch)
+        except Exception as e:
+            print(f"Error in emotion detection: {e}")
+            return [], None
+        
+        return self.build_results(face_boxes, probabilities)
+    
+    def build_results(self, face_boxes, probabilities):
+        """
+        Pair face boxes with their predicted probabilities
+        Returns: list of per-face results and the aggregated room mood
+        """
+        results = []
+        for box, face_probabilities in zip(face_boxes, probabilities):
+            index = int(np.argmax(face_probabilities))
+            results.append({
+                'emotion': self.emotions[index],
+                'confidence': float(face_probabilities[index]),
+                'face_coords': box,
+                'probabilities': face_probabilities
+            })
+        
+        return results, self.aggregate_mood(results)
+    
+    def aggregate_mood(self, results):
+        """
+        Combine per-face probabilities into a room mood, weighting each face
+        by its area so people close to the camera count more
+        """
+        if not results:
+            return None
+        
+        weights = np.array([r['face_coords'][2] * r['face_coords'][3] for r in results], dtype=np.float32)
+        probabilities = np.stack([r['probabilities'] for r in results])
+        mood = (weights[:, np.newaxis] * probabilities).sum(axis=0) / weights.sum()
+        
+        index = int(np.argmax(mood))
+        return {
+            'emotion': self.emotions[index],
+            'confidence': float(mood[index]),
+            'probabilities': mood
+        }
     
     def draw_emotion_on_frame(self, frame, emotion, face_coords):
         """
@@ -0,0 +1,78 @@
+import math
+import numpy as np
+import time
+
+
+class EmotionStateMachine:
+    """
+    Turns noisy per-frame emotion probabilities into a stable current emotion.
+
+    Probabilities are smoothed with an exponentially-weighted moving average
+    (time based, so irregular detection intervals are handled). A different
+    emotion only takes over once it leads the current one by `margin` for at
+    least `min_dwell` seconds, and never sooner than `min_switch_interval`
+    seconds after the previous switch.
+    """
+    def __init__(self, emotions, initial="neutral", smoothing=2.0, margin=0.15,
+                 min_dwell=2.0, min_switch_interval=10.0):
+        self.emotions = list(emotions)
+        self.smoothing = smoothing
+        self.margin = margin
+        self.min_dwell = min_dwell
+        self.min_switch_interval = min_switch_interval
+
+        self.initial = initial
+        self.reset()
+
+    def reset(self, current=None):
+        self.current = current or self.initial
+        self.probabilities = None
+        self.last_update = None
+        self.last_switch = None
+        self.candidate = None
+        self.candidate_since = None
+
+    def update(self, probabilities, now=None):
+        """
+        Feed a new probability vector (ordered like self.emotions)
+        Returns: the new emotion if the state switched, otherwise None
+        """
+        now = time.time() if now is None else now
+        probabilities = np.asarray(probabilities, dtype=np.float32)
+
+        if self.probabilities is None:
+            self.probabilities = probabilities.copy()
+        else:
+            dt = max(now - self.last_update, 0.0)
+            alpha = 1.0 - math.exp(-dt / self.smoothing) if self.smoothing > 0 else 1.0
+            self.probabilities += alpha * (probabilities - self.probabilities)
+        self.last_update = now
+
+        best = self.emotions[int(np.argmax(self.probabilities))]
+        lead = self.probabilities[self.emotions.index(best)] - self.probabilities[self.emotions.index(self.current)]
+
+        if best == self.current or lead < self.margin:
+            self.candidate = None
+            self.candidate_since = None
+            return None
+
+        if best != self.candidate:
+            self.candidate = best
+            self.candidate_since = now
+
+        if now - self.candidate_since < self.min_dwell:
+            return None
+        if self.last_switch is not None and now - self.last_switch < self.min_switch_interval:
+            return None
+
+        self.current = best
+        self.last_switch = now
+        self.candidate = None
+        self.candidate_since = None
+        return self.current
+
+    def smoothed(self):
+        """Smoothed probabilities as a dict, or None before the first update"""
+        if self.probabilities is None:
+            return None
+        return {emotion: float(p) for emotion, p in zip(self.emotions, self.probabilities)}
@@ -0,0 +1,181 @@
+import cv2
+import numpy as np
+import os
+import time
+from collections import deque
+from metrics import registry
+
+FACE_DETECTION_SECONDS = registry.histogram("face_detection_seconds", "Time to find the faces in one frame",
+                                            ["backend"])
+
+
+class FaceDetectorBackend:
+    """
+    Base class for face detectors used by EmotionDetector.
+
+    Subclasses implement _detect(gray, frame) and return (x, y, w, h) boxes.
+    The base class adds two speed-ups that work with any backend:
+      - downscale: search a smaller copy of the image and scale the boxes
+        back up, skipping the most expensive levels of the image pyramid
+      - roi: search only a region around a known face box, falling back to
+        the full frame if nothing is found there
+    and records the latency of every call so backends can be compared.
+    """
+    name = "base"
+
+    def __init__(self, downscale=1.0, roi_margin=0.5):
+        self.downscale = downscale
+        self.roi_margin = roi_margin
+        self.timings = deque(maxlen=500)
+
+    def detect(self, gray, frame=None, roi=None):
+        """
+        Find faces in a frame
+        gray: grayscale frame; frame: the BGR frame, needed by colour backends
+        roi: optional (x, y, w, h) of a known face to search around first
+        Returns: list of (x, y, w, h) boxes in full-frame coordinates
+        """
+        start = time.perf_counter()
+        try:
+            faces = []
+            if roi is not None:
+                faces = self._detect_in_roi(gray, frame, roi)
+            if not faces:
+                faces = self._detect_scaled(gray, frame, 0, 0)
+            return faces
+        finally:
+            elapsed = time.perf_counter() - start
+            self.timings.append(elapsed)
+            FACE_DETECTION_SECONDS.observe(elapsed, backend=self.name)
+
+    def stats(self):
+        """Latency summary of recent calls in milliseconds"""
+        if not self.timings:
+            return {"backend": self.name, "count": 0}
+        values = np.asarray(self.timings) * 1000.0
+        p50, p95 = np.percentile(values, [50, 95])
+        return {
+            "backend": self.name,
+            "count": len(values),
+            "mean_ms": round(float(values.mean()), 3),
+            "p50_ms": round(float(p50), 3),
+            "p95_ms": round(float(p95), 3)
+        }
+
+    def _detect_in_roi(self, gray, frame, roi):
+        x, y, w, h = roi
+        height, width = gray.shape[:2]
+        margin_x, margin_y = int(w * self.roi_margin), int(h * self.roi_margin)
+        x0, y0 = max(x - margin_x, 0), max(y - margin_y, 0)
+        x1, y1 = min(x + w + margin_x, width), min(y + h + margin_y, height)
+        if x1 <= x0 or y1 <= y0:
+            return []
+
+        return self._detect_scaled(
+            gray[y0:y1, x0:x1],
+            frame[y0:y1, x0:x1] if frame is not None else None,
+            x0, y0
+        )
+
+    def _detect_scaled(self, gray, frame, offset_x, offset_y):
+        scale = self.downscale
+        if scale != 1.0:
+            gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            if frame is not None:
+                frame = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+        return [(int(x / scale) + offset_x, int(y / scale) + offset_y, int(w / scale), int(h / scale))
+                for x, y, w, h in self._detect(gray, frame)]
+
+    def _detect(self, gray, frame):
+        raise NotImplementedError
+
+
+class CascadeBackend(FaceDetectorBackend):
+    """OpenCV cascade classifier (Haar or LBP features)"""
+    def __init__(self, path, scale_factor=1.1, min_neighbors=4, min_size=None, **options):
+        super().__init__(**options)
+        if not os.path.exists(path):
+            raise ValueError(f"Cascade file not found: {path}")
+        self.cascade = cv2.CascadeClassifier(path)
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        self.min_size = min_size
+
+    def _detect(self, gray, frame):
+        if self.min_size is None:
+            return self.cascade.detectMultiScale(gray, self.scale_factor, self.min_neighbors)
+        # Keep the minimum face size constant in full-frame pixels
+        min_size = tuple(max(int(v * self.downscale), 1) for v in self.min_size)
+        return self.cascade.detectMultiScale(gray, self.scale_factor, self.min_neighbors, minSize=min_size)
+
+
+class HaarCascadeBackend(CascadeBackend):
+    name = "haar"
+
+    def __init__(self, path=None, **options):
+        super().__init__(path or cv2.data.haarcascades + 'haarcascade_frontalface_default.xml', **options)
+
+
+class LBPCascadeBackend(CascadeBackend):
+    """
+    LBP cascades are several times faster than Haar at slightly lower
+    accuracy. The pip OpenCV wheels don't ship them, so point `path` at
+    lbpcascade_frontalface_improved.xml from the OpenCV repository.
+    """
+    name = "lbp"
+
+    def __init__(self, path=None, **options):
+        if path is None:
+            path = os.path.join(os.path.dirname(cv2.data.haarcascades.rstrip(os.sep)),
+                                'lbpcascades', 'lbpcascade_frontalface_improved.xml')
+        super().__init__(path, **options)
+
+
+class DnnFaceBackend(FaceDetectorBackend):
+    """
+    OpenCV DNN res10 SSD face detector (deploy.prototxt and
+    res10_300x300_ssd_iter_140000.caffemodel)
+    """
+    name = "dnn"
+
+    def __init__(self, prototxt, model, confidence=0.5, input_size=(300, 300), **options):
+        super().__init__(**options)
+        if not os.path.exists(prototxt) or not os.path.exists(model):
+            raise ValueError(f"DNN face model files not found: {prototxt}, {model}")
+        self.net = cv2.dnn.readNetFromCaffe(prototxt, model)
+        self.confidence = confidence
+        self.input_size = input_size
+
+    def _detect(self, gray, frame):
+        if frame is None:
+            frame = cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
+        height, width = frame.shape[:2]
+
+        blob = cv2.dnn.blobFromImage(frame, 1.0, self.input_size, (104.0, 177.0, 123.0))
+        self.net.setInput(blob)
+        detections = self.net.forward()[0, 0]
+
+        detections = detections[detections[:, 2] >= self.confidence]
+        boxes = detections[:, 3:7] * np.array([width, height, width, height])
+        faces = []
+        for x0, y0, x1, y1 in boxes:
+            x0, y0 = max(int(x0), 0), max(int(y0), 0)
+            x1, y1 = min(int(x1), width), min(int(y1), height)
+            if x1 > x0 and y1 > y0:
+                faces.append((x0, y0, x1 - x0, y1 - y0))
+        return faces
+
+
+FACE_BACKENDS = {
+    "haar": HaarCascadeBackend,
+    "lbp": LBPCascadeBackend,
+    "dnn": DnnFaceBackend
+}
+
+
+def create_face_backend(name="haar", **options):
+    """Build a face detector backend by name"""
+    if name not in FACE_BACKENDS:
+        raise ValueError(f"Unknown face detector '{name}', expected one of {', '.join(FACE_BACKENDS)}")
+    return FACE_BACKENDS[name](**options)
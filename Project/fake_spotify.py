@@ -0,0 +1,339 @@
+"""
+Local stand-in for the parts of the Spotify Web API that MusicPlayer uses.
+
+Serves a generated library (playlists, saved tracks, audio features),
+recommendations, devices and playback commands, with configurable
+latency, random 404s and 429 rate limiting, and counts every call so
+caching and retry changes can be measured offline.
+
+Usage:
+    python fake_spotify.py --port 8900 --latency 0.05 --rate-limit 20
+
+Then point MusicPlayer at it with api_url="http://127.0.0.1:8900/v1/"
+(SPOTIFY_API_URL in config.py). Any access token is accepted.
+GET /_stats returns the call counts and POST /_reset clears them.
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+EMOTION_PLAYLIST_NAMES = ["Happy Hits", "Sad Songs", "Angry Metal", "Chill Focus", "Epic Cinematic",
+                          "Horror Suspense", "Dark Intense", "Party Dance"]
+
+
+def generate_library(playlists=20, tracks_per_playlist=100, saved_tracks=500, seed=0):
+    """
+    Build a deterministic fake library
+    Returns: dict with user, playlists, saved tracks and audio features by track ID
+    """
+    rng = random.Random(seed)
+    tracks = {}
+
+    def make_track(index):
+        track_id = f"track{index:06d}"
+        track = {
+            "id": track_id,
+            "name": f"Track {index}",
+            "uri": f"spotify:track:{track_id}",
+            "type": "track",
+            "duration_ms": 150000 + (index * 7919) % 120000,
+            "artists": [{"name": f"Artist {index % 97}"}],
+            "album": {"name": f"Album {index % 211}", "images": [{"url": f"https://example.com/{index % 211}.jpg"}]}
+        }
+        tracks[track_id] = track
+        return track
+
+    library = {"user": {"id": "fake-user", "display_name": "Fake User"}, "playlists": [], "saved_tracks": []}
+    next_index = 0
+    for number in range(playlists):
+        name = EMOTION_PLAYLIST_NAMES[number % len(EMOTION_PLAYLIST_NAMES)]
+        items = []
+        for _ in range(tracks_per_playlist):
+            items.append(make_track(next_index))
+            next_index += 1
+        library["playlists"].append({
+            "id": f"playlist{number:04d}",
+            "name": f"{name} {number}",
+            "snapshot_id": f"snapshot-{number}-1",
+            "tracks": items
+        })
+
+    # Saved tracks overlap with the playlists, like a real library
+    pool = list(tracks.values())
+    for index in range(saved_tracks):
+        library["saved_tracks"].append(pool[index] if index < len(pool) // 2 else make_track(next_index + index))
+
+    library["tracks"] = tracks
+    library["features"] = {
+        track_id: {
+            "id": track_id,
+            "valence": round(rng.random(), 3),
+            "energy": round(rng.random(), 3),
+            "tempo": round(rng.uniform(60, 180), 1)
+        } for track_id in tracks
+    }
+    return library
+
+
+class FakeSpotifyServer:
+    """
+    Threaded HTTP server answering Spotify Web API requests from a generated
+    library. latency (+ random jitter) is added to every call; error_404_rate
+    of calls fail with 404; with rate_limit set, more than that many calls
+    in a rolling second get 429 with a Retry-After header.
+    """
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, jitter=0.0, error_404_rate=0.0,
+                 rate_limit=None, retry_after=1, library=None, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_404_rate = error_404_rate
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.library = library or generate_library(seed=seed)
+        self.rng = random.Random(seed)
+
+        self.lock = threading.Lock()
+        self.calls = Counter()
+        self.errors = Counter()
+        self.recent = deque()
+        self.playing = None
+        self.queue = []
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                server.handle(self, "GET")
+
+            def do_PUT(self):
+                server.handle(self, "PUT")
+
+            def do_POST(self):
+                server.handle(self, "POST")
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1/"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="fake-spotify")
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "calls": dict(self.calls),
+                "total_calls": sum(self.calls.values()),
+                "errors": {f"{status} {endpoint}": count for (status, endpoint), count in self.errors.items()},
+                "playing": self.playing,
+                "queued": len(self.queue)
+            }
+
+    def reset(self):
+        with self.lock:
+            self.calls.clear()
+            self.errors.clear()
+            self.recent.clear()
+            self.queue = []
+
+    # Request handling
+
+    routes = [
+        ("GET", r"/v1/me", "me"),
+        ("GET", r"/v1/me/playlists", "playlists"),
+        ("GET", r"/v1/playlists/(?P<playlist_id>[^/]+)/tracks", "playlist_tracks"),
+        ("GET", r"/v1/me/tracks", "saved_tracks"),
+        ("GET", r"/v1/audio-features", "audio_features"),
+        ("GET", r"/v1/recommendations", "recommendations"),
+        ("GET", r"/v1/me/player", "player"),
+        ("GET", r"/v1/me/player/devices", "devices"),
+        ("GET", r"/v1/me/player/queue", "queue"),
+        ("PUT", r"/v1/me/player/play", "play"),
+        ("POST", r"/v1/me/player/queue", "add_to_queue"),
+        ("POST", r"/v1/me/player/next", "next_track")
+    ]
+
+    def handle(self, request, method):
+        parsed = urlparse(request.path)
+        path = parsed.path.rstrip("/")
+        query = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+        length = int(request.headers.get("Content-Length") or 0)
+        body = json.loads(request.rfile.read(length) or b"null") if length else None
+
+        if path == "/_stats":
+            return self.respond(request, 200, self.stats())
+        if path == "/_reset":
+            self.reset()
+            return self.respond(request, 200, {"status": "reset"})
+
+        for route_method, pattern, endpoint in self.routes:
+            match = re.fullmatch(pattern, path)
+            if route_method == method and match:
+                break
+        else:
+            return self.respond(request, 404, {"error": {"status": 404, "message": "Unknown endpoint"}})
+
+        delay = self.latency + (self.rng.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay:
+            time.sleep(delay)
+
+        with self.lock:
+            self.calls[endpoint] += 1
+            now = time.monotonic()
+            self.recent.append(now)
+            while self.recent and self.recent[0] < now - 1.0:
+                self.recent.popleft()
+            limited = self.rate_limit is not None and len(self.recent) > self.rate_limit
+            not_found = not limited and self.rng.random() < self.error_404_rate
+            if limited or not_found:
+                self.errors[(429 if limited else 404, endpoint)] += 1
+
+        if limited:
+            return self.respond(request, 429, {"error": {"status": 429, "message": "API rate limit exceeded"}},
+                                {"Retry-After": str(self.retry_after)})
+        if not_found:
+            return self.respond(request, 404, {"error": {"status": 404, "message": "Not found"}})
+
+        status, payload = getattr(self, f"api_{endpoint}")(query, body, **match.groupdict())
+        self.respond(request, status, payload)
+
+    def respond(self, request, status, payload=None, headers=None):
+        data = json.dumps(payload).encode() if payload is not None else b""
+        request.send_response(status)
+        request.send_header("Content-Type", "application/json")
+        request.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            request.send_header(name, value)
+        request.end_headers()
+        request.wfile.write(data)
+
+    @staticmethod
+    def page(items, query, wrap=None):
+        offset = int(query.get("offset", 0))
+        limit = int(query.get("limit", 20))
+        chunk = items[offset:offset + limit]
+        return {
+            "items": [wrap(item) for item in chunk] if wrap else chunk,
+            "total": len(items),
+            "offset": offset,
+            "limit": limit,
+            "next": None if offset + limit >= len(items) else f"offset={offset + limit}"
+        }
+
+    # Endpoints
+
+    def api_me(self, query, body):
+        return 200, self.library["user"]
+
+    def api_playlists(self, query, body):
+        playlists = [{
+            "id": playlist["id"],
+            "name": playlist["name"],
+            "snapshot_id": playlist["snapshot_id"],
+            "tracks": {"total": len(playlist["tracks"])}
+        } for playlist in self.library["playlists"]]
+        return 200, self.page(playlists, query)
+
+    def api_playlist_tracks(self, query, body, playlist_id):
+        for playlist in self.library["playlists"]:
+            if playlist["id"] == playlist_id:
+                return 200, self.page(playlist["tracks"], query, lambda track: {"track": track})
+        return 404, {"error": {"status": 404, "message": "Playlist not found"}}
+
+    def api_saved_tracks(self, query, body):
+        return 200, self.page(self.library["saved_tracks"], query,
+                              lambda track: {"added_at": "2024-01-01T00:00:00Z", "track": track})
+
+    def api_audio_features(self, query, body):
+        ids = [track_id for track_id in query.get("ids", "").split(",") if track_id]
+        return 200, {"audio_features": [self.library["features"].get(track_id) for track_id in ids]}
+
+    def api_recommendations(self, query, body):
+        limit = int(query.get("limit", 20))
+        tracks = list(self.library["tracks"].values())
+        return 200, {"tracks": self.rng.sample(tracks, min(limit, len(tracks)))}
+
+    def api_devices(self, query, body):
+        return 200, {"devices": [{"id": "fake-device", "name": "Fake Speaker", "type": "Speaker", "is_active": True}]}
+
+    def api_player(self, query, body):
+        with self.lock:
+            playing = self.playing
+        track = self.library["tracks"].get(playing.rsplit(":", 1)[-1]) if playing else None
+        if track is None:
+            return 204, None
+        return 200, {"is_playing": True, "progress_ms": 0, "item": track}
+
+    def api_queue(self, query, body):
+        with self.lock:
+            return 200, {"currently_playing": self.playing, "queue": list(self.queue)}
+
+    def api_play(self, query, body):
+        uris = (body or {}).get("uris") or []
+        with self.lock:
+            self.playing = uris[0] if uris else self.playing
+            self.queue = uris[1:]
+        return 204, None
+
+    def api_add_to_queue(self, query, body):
+        with self.lock:
+            self.queue.append(query.get("uri"))
+        return 204, None
+
+    def api_next_track(self, query, body):
+        with self.lock:
+            if self.queue:
+                self.playing = self.queue.pop(0)
+        return 204, None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local fake Spotify Web API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Extra random latency of up to this many seconds")
+    parser.add_argument("--error-404-rate", type=float, default=0.0, help="Fraction of calls answered with 404")
+    parser.add_argument("--rate-limit", type=int, default=None, help="Calls per second before answering 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with 429 responses")
+    parser.add_argument("--playlists", type=int, default=20)
+    parser.add_argument("--tracks-per-playlist", type=int, default=100)
+    parser.add_argument("--saved-tracks", type=int, default=500)
+    args = parser.parse_args()
+
+    server = FakeSpotifyServer(
+        args.host, args.port, latency=args.latency, jitter=args.jitter, error_404_rate=args.error_404_rate,
+        rate_limit=args.rate_limit, retry_after=args.retry_after,
+        library=generate_library(args.playlists, args.tracks_per_playlist, args.saved_tracks)
+    )
+    print(f"Fake Spotify API listening on {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+import cv2
+import numpy as np
+import threading
+import time
+from collections import deque
+from metrics import registry
+
+FRAMES_CAPTURED = registry.counter("frames_captured_total", "Frames read from a camera", ["camera"])
+FRAMES_DECODED = registry.counter("frames_decoded_total", "Compressed camera frames decoded for analysis", ["camera"])
+
+# imread flags for decoding at 1/n of the camera resolution
+DECODE_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8
+}
+
+
+class Frame:
+    """
+    A captured frame together with its sequence number and capture time.
+    The image is marked read-only so consumers can share it without copying.
+
+    Frames captured in passthrough mode carry the camera's JPEG bytes
+    instead; they are only decoded (with decode_flags) the first time
+    someone reads `image`, and image is None if the data can't be decoded.
+    """
+    __slots__ = ("seq", "timestamp", "jpeg", "decode_flags", "camera", "_image")
+
+    def __init__(self, seq, timestamp, image=None, jpeg=None, decode_flags=cv2.IMREAD_COLOR, camera=None):
+        self.seq = seq
+        self.timestamp = timestamp
+        self.jpeg = jpeg
+        self.decode_flags = decode_flags
+        self.camera = camera
+        self._image = image
+
+    @property
+    def image(self):
+        if self._image is None and self.jpeg is not None:
+            image = cv2.imdecode(np.frombuffer(self.jpeg, dtype=np.uint8), self.decode_flags)
+            if image is None:
+                return None
+            image.flags.writeable = False
+            FRAMES_DECODED.inc(camera=self.camera)
+            self._image = image
+        return self._image
+
+
+class FrameBus:
+    """
+    Reads frames from one camera on a single thread and keeps the most
+    recent buffer_size of them for any number of consumers.
+
+    width, height, fps, fourcc (e.g. "MJPG") and capture_buffer_size (the
+    driver's own frame queue) are requested from the camera when it opens;
+    the camera may pick the nearest mode it supports. With passthrough the
+    camera is asked for MJPEG and its compressed frames are kept as they
+    are, to be streamed without re-encoding and decoded at 1/decode_scale
+    resolution only when a consumer needs the pixels. Cameras or backends
+    that can't hand out the raw bytes fall back to decoded frames.
+    """
+    def __init__(self, camera_index=0, buffer_size=4, width=None, height=None, fps=None, fourcc=None,
+                 capture_buffer_size=None, passthrough=False, decode_scale=1):
+        if decode_scale not in DECODE_FLAGS:
+            raise ValueError(f"decode_scale must be one of {sorted(DECODE_FLAGS)}, got {decode_scale}")
+        self.camera_index = camera_index
+        self.buffer_size = buffer_size
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.fourcc = "MJPG" if passthrough and not fourcc else fourcc
+        self.capture_buffer_size = capture_buffer_size
+        self.passthrough = passthrough
+        self.decode_flags = DECODE_FLAGS[decode_scale]
+        self.raw = False
+
+        self.capture = None
+        self.frames = deque(maxlen=buffer_size)
+        self.seq = 0
+        self.condition = threading.Condition()
+        self.running = False
+        self.reader_thread = None
+
+    def start(self):
+        """
+        Open the capture device and start the reader thread
+        Raises IOError if the camera can't be opened
+        """
+        with self.condition:
+            if self.running:
+                return
+            capture = cv2.VideoCapture(self.camera_index)
+            if not capture.isOpened():
+                capture.release()
+                raise IOError(f"Could not open camera {self.camera_index}")
+            self.capture = capture
+            self.raw = self.configure_capture(self.capture)
+            self.running = True
+
+        self.reader_thread = threading.Thread(target=self._read_loop)
+        self.reader_thread.daemon = True
+        self.reader_thread.start()
+
+    def stop(self):
+        """Stop the reader thread and release the capture device"""
+        with self.condition:
+            if not self.running:
+                return
+            self.running = False
+            # Wake up any consumer blocked in wait_for_frame
+            self.condition.notify_all()
+
+        if self.reader_thread is not None and self.reader_thread is not threading.current_thread():
+            self.reader_thread.join(timeout=2)
+        self.reader_thread = None
+
+        with self.condition:
+            if self.capture is not None:
+                self.capture.release()
+                self.capture = None
+            self.frames.clear()
+
+    def is_running(self):
+        return self.running
+
+    def configure_capture(self, capture):
+        """
+        Request the configured capture format from the camera
+        Returns: True if frames will be read as undecoded JPEG bytes
+        """
+        if self.fourcc:
+            capture.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*self.fourcc))
+        if self.width:
+            capture.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+        if self.height:
+            capture.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+        if self.fps:
+            capture.set(cv2.CAP_PROP_FPS, self.fps)
+        if self.capture_buffer_size:
+            capture.set(cv2.CAP_PROP_BUFFERSIZE, self.capture_buffer_size)
+
+        code = int(capture.get(cv2.CAP_PROP_FOURCC))
+        fourcc = "".join(chr((code >> 8 * i) & 0xFF) for i in range(4)) if code > 0 else "?"
+        print(f"Camera {self.camera_index}: {int(capture.get(cv2.CAP_PROP_FRAME_WIDTH))}x"
+              f"{int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))} at {capture.get(cv2.CAP_PROP_FPS):g} fps, {fourcc}")
+
+        if not self.passthrough:
+            return False
+        # A format of -1 makes the backend return the buffer without decoding it
+        if fourcc != "MJPG" or not capture.set(cv2.CAP_PROP_FORMAT, -1):
+            print(f"Camera {self.camera_index} can't pass MJPEG through, decoding frames instead")
+            return False
+        return True
+
+    def _read_loop(self):
+        """
+        Only this thread ever calls read() on the capture device, so
+        consumers never compete for frames.
+        """
+        while self.running:
+            ret, image = self.capture.read()
+            if not ret or image is None or not image.size:
+                time.sleep(0.01)
+                continue
+
+            FRAMES_CAPTURED.inc(camera=self.camera_index)
+            if self.raw and image.ndim < 3:
+                # One row of compressed bytes; copy them out of the capture's buffer
+                jpeg = image.tobytes()
+                if not jpeg.startswith(b"\xff\xd8"):
+                    continue
+                frame_args = {"jpeg": jpeg, "decode_flags": self.decode_flags, "camera": self.camera_index}
+            else:
+                image.flags.writeable = False
+                frame_args = {"image": image}
+
+            with self.condition:
+                self.seq += 1
+                self.frames.append(Frame(self.seq, time.time(), **frame_args))
+                self.condition.notify_all()
+
+    def latest(self):
+        """
+        Return the most recent frame, or None if nothing has been captured yet
+        """
+        with self.condition:
+            if not self.frames:
+                return None
+            return self.frames[-1]
+
+    def wait_for_frame(self, after_seq=0, timeout=1.0):
+        """
+        Block until a frame newer than after_seq is available.
+        Returns the newest frame, or None on timeout or when the bus stops.
+        """
+        deadline = time.time() + timeout
+        with self.condition:
+            while self.running and (not self.frames or self.frames[-1].seq <= after_seq):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                self.condition.wait(remaining)
+
+            if not self.frames or self.frames[-1].seq <= after_seq:
+                return None
+            return self.frames[-1]
+
+    def recent(self):
+        """
+        Return a snapshot of the buffered frames, oldest first
+        """
+        with self.condition:
+            return list(self.frames)
@@ -0,0 +1,325 @@
+import itertools
+import multiprocessing
+import queue
+import threading
+import time
+import numpy as np
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+from multiprocessing import shared_memory
+from emotion_detector import EmotionDetector, EMOTION_INFERENCE_SECONDS, FACES_ANALYSED
+from face_backends import FACE_DETECTION_SECONDS
+from metrics import registry
+
+INFERENCE_DROPS = registry.counter("inference_drops_total", "Frames the inference pool did not analyse", ["reason"])
+INFERENCE_WORKER_RESTARTS = registry.counter("inference_worker_restarts_total",
+                                             "Inference worker processes started again after dying")
+
+
+class ThreadInferencePool:
+    """
+    Bounded pool of inference workers shared by all sessions.
+
+    Every worker thread gets its own EmotionDetector (and so its own face
+    detector, which OpenCV doesn't guarantee to be thread-safe) but they all
+    share the one loaded emotion model. At most `workers` frames are being
+    analysed at any time, however many sessions are running.
+    """
+    def __init__(self, detector, workers=2):
+        self.detector = detector
+        self.workers = workers
+        self.local = threading.local()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="inference")
+
+    def _worker_detector(self):
+        detector = getattr(self.local, 'detector', None)
+        if detector is None:
+            detector = EmotionDetector(model=self.detector.model, warm_up=False, background=False,
+                                       face_detector=self.detector.face_detector,
+                                       face_detector_options=self.detector.face_detector_options,
+                                       emotion_backend=self.detector.emotion_backend)
+            self.local.detector = detector
+        return detector
+
+    def is_ready(self):
+        return self.detector.is_ready()
+
+    @property
+    def load_error(self):
+        return self.detector.load_error
+
+    def wait_ready(self, timeout=None):
+        """Block until the model is loaded; returns whether it is"""
+        return self.detector.ready_event.wait(timeout)
+
+    def detect_emotions(self, frame, roi=None):
+        """
+        Run EmotionDetector.detect_emotions on a pool worker and wait for the result
+        Returns: (faces, mood), or None while the model is still loading
+        """
+        if not self.detector.is_ready():
+            INFERENCE_DROPS.inc(reason="loading")
+            return None
+        return self.executor.submit(lambda: self._worker_detector().detect_emotions(frame, roi)).result()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+
+def _process_worker(worker_id, slot_names, task_queue, result_queue, max_age, detector_kwargs):
+    """
+    Entry point of an inference worker process. Frames are read straight
+    from shared memory; only the small results travel back through the queue.
+    """
+    slots = [shared_memory.SharedMemory(name=name) for name in slot_names]
+    try:
+        detector = EmotionDetector(background=False, **detector_kwargs)
+    except Exception as e:
+        # Tell the pool, so /health can report it instead of waiting forever
+        print(f"Inference worker {worker_id} could not load the model: {e}")
+        result_queue.put(("error", worker_id, str(e), None))
+        for shm in slots:
+            shm.close()
+        return
+    result_queue.put(("ready", worker_id, None, None))
+
+    try:
+        while True:
+            task = task_queue.get()
+            if task is None:
+                break
+
+            request_id, slot, shape, dtype, roi, submitted = task
+            if time.time() - submitted > max_age:
+                # Stale by the time a worker got to it, the caller has newer frames
+                result_queue.put(("dropped", request_id, None, None))
+                continue
+
+            frame = np.ndarray(shape, dtype=dtype, buffer=slots[slot].buf)
+            try:
+                faces, mood = detector.detect_emotions(frame, roi)
+                # Metrics recorded here stay in this process, so send the timings along
+                result_queue.put(("done", request_id, (faces, mood), detector.last_timings))
+            except Exception as e:
+                print(f"Error in inference worker {worker_id}: {e}")
+                result_queue.put(("done", request_id, ([], None), None))
+    finally:
+        for shm in slots:
+            shm.close()
+
+
+class ProcessInferencePool:
+    """
+    Runs EmotionDetector in separate worker processes so inference doesn't
+    compete with the web server for the GIL.
+
+    Frames are copied into one of a fixed number of shared-memory slots and
+    only the slot index and shape are sent to a worker, so frames are never
+    pickled. When every slot is busy the new frame is dropped instead of
+    queueing up, and workers skip frames that waited longer than max_age.
+    detect_emotions returns None for a dropped frame. detector_kwargs are
+    passed to each worker's EmotionDetector, e.g. to choose the face detector.
+
+    Each worker has its own task queue, so the pool knows which frames a
+    worker holds. A watchdog checks the workers every watch_interval
+    seconds; when one has died (OOM kill, native crash) its frames are
+    dropped, their slots freed, and it is started again. The pool reports
+    not ready until the new worker has loaded its model.
+
+    Workers are started with fork where available, so the pool should be
+    created before TensorFlow is imported or any threads are started.
+    """
+    def __init__(self, processes=2, slots=None, max_frame_bytes=1920 * 1080 * 3,
+                 max_age=0.5, slot_timeout=0.05, result_timeout=10.0, detector_kwargs=None,
+                 watch_interval=1.0):
+        self.processes = processes
+        self.max_frame_bytes = max_frame_bytes
+        self.max_age = max_age
+        self.slot_timeout = slot_timeout
+        self.result_timeout = result_timeout
+        self.watch_interval = watch_interval
+        self.detector_kwargs = detector_kwargs = dict(detector_kwargs or {})
+        self.face_detector = detector_kwargs.get("face_detector", "haar")
+        self.emotion_backend = detector_kwargs.get("emotion_backend", "deepface")
+
+        methods = multiprocessing.get_all_start_methods()
+        self.context = multiprocessing.get_context("fork" if "fork" in methods else "spawn")
+
+        slot_count = slots or processes * 2
+        self.slots = [shared_memory.SharedMemory(create=True, size=max_frame_bytes) for _ in range(slot_count)]
+        self.free_slots = queue.Queue()
+        for index in range(slot_count):
+            self.free_slots.put(index)
+
+        self.result_queue = self.context.Queue()
+        # request_id -> (future, slot, worker_id); in_flight counts each worker's frames
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+        self.request_ids = itertools.count()
+        self.ready_workers = set()
+        self.failed_workers = set()
+        self.ready_event = threading.Event()
+        self.load_error = None
+        self.running = True
+
+        self.workers = [None] * processes
+        self.task_queues = [None] * processes
+        self.in_flight = [0] * processes
+        for worker_id in range(processes):
+            self._start_worker(worker_id)
+
+        self.collector = threading.Thread(target=self._collect_results, name="inference-results")
+        self.collector.daemon = True
+        self.collector.start()
+
+        self.watchdog = threading.Thread(target=self._watch_workers, name="inference-watchdog")
+        self.watchdog.daemon = True
+        self.watchdog.start()
+
+    def _start_worker(self, worker_id):
+        task_queue = self.context.Queue()
+        worker = self.context.Process(
+            target=_process_worker,
+            args=(worker_id, [shm.name for shm in self.slots], task_queue, self.result_queue,
+                  self.max_age, self.detector_kwargs),
+            name=f"inference-{worker_id}"
+        )
+        worker.daemon = True
+        worker.start()
+        with self.pending_lock:
+            self.task_queues[worker_id] = task_queue
+            self.workers[worker_id] = worker
+
+    def is_ready(self):
+        """Whether every worker has loaded its model"""
+        return len(self.ready_workers) == self.processes
+
+    def wait_ready(self, timeout=None):
+        """Block until every worker has loaded its model; returns whether they have"""
+        return self.ready_event.wait(timeout)
+
+    def detect_emotions(self, frame, roi=None):
+        """
+        Analyse a frame on a worker process and wait for the result
+        Returns: (faces, mood) like EmotionDetector.detect_emotions, or None if the frame was dropped
+        """
+        if not self.is_ready():
+            # Workers are still loading their models
+            INFERENCE_DROPS.inc(reason="loading")
+            return None
+
+        if frame.nbytes > self.max_frame_bytes:
+            print(f"Frame of {frame.nbytes} bytes doesn't fit in a {self.max_frame_bytes} byte slot, dropping it")
+            INFERENCE_DROPS.inc(reason="too_large")
+            return None
+
+        try:
+            slot = self.free_slots.get(timeout=self.slot_timeout)
+        except queue.Empty:
+            # All workers are busy: drop this frame, the next one will be fresher
+            INFERENCE_DROPS.inc(reason="busy")
+            return None
+
+        try:
+            shared = np.ndarray(frame.shape, dtype=frame.dtype, buffer=self.slots[slot].buf)
+            shared[...] = frame
+
+            request_id = next(self.request_ids)
+            future = Future()
+            with self.pending_lock:
+                # The ready worker with the fewest frames in hand
+                ready = [worker_id for worker_id in self.ready_workers if self.workers[worker_id].is_alive()]
+                if not ready:
+                    self.free_slots.put(slot)
+                    INFERENCE_DROPS.inc(reason="loading")
+                    return None
+                worker_id = min(ready, key=lambda worker_id: self.in_flight[worker_id])
+                self.pending[request_id] = (future, slot, worker_id)
+                self.in_flight[worker_id] += 1
+                task_queue = self.task_queues[worker_id]
+            task_queue.put((request_id, slot, frame.shape, frame.dtype.str, roi, time.time()))
+        except Exception:
+            self.free_slots.put(slot)
+            raise
+
+        # The slot is freed by the result collector once the worker is done
+        # with it, even if we stop waiting before then
+        try:
+            return future.result(timeout=self.result_timeout)
+        except TimeoutError:
+            print("Inference worker did not answer in time, dropping frame")
+            INFERENCE_DROPS.inc(reason="timeout")
+            return None
+
+    def _collect_results(self):
+        while True:
+            try:
+                kind, key, payload, timings = self.result_queue.get()
+            except (EOFError, OSError):
+                return
+
+            if kind == "error":
+                self.load_error = payload
+                with self.pending_lock:
+                    self.failed_workers.add(key)
+                continue
+            if kind == "ready":
+                with self.pending_lock:
+                    self.ready_workers.add(key)
+                if self.is_ready():
+                    self.ready_event.set()
+                continue
+            if kind == "dropped":
+                INFERENCE_DROPS.inc(reason="stale")
+            if timings:
+                self._record_timings(payload, timings)
+
+            with self.pending_lock:
+                entry = self.pending.pop(key, None)
+                if entry is not None:
+                    self.in_flight[entry[2]] -= 1
+            if entry is not None:
+                future, slot, _ = entry
+                self.free_slots.put(slot)
+                future.set_result(payload if kind == "done" else None)
+
+    def _watch_workers(self):
+        while self.running:
+            time.sleep(self.watch_interval)
+            for worker_id, worker in enumerate(list(self.workers)):
+                if not self.running or worker.is_alive() or worker_id in self.failed_workers:
+                    continue
+                print(f"Inference worker {worker_id} died (exit code {worker.exitcode}), restarting it")
+                self._replace_worker(worker_id)
+
+    def _replace_worker(self, worker_id):
+        # Its frames will never be answered: drop them and free their slots
+        with self.pending_lock:
+            self.ready_workers.discard(worker_id)
+            self.ready_event.clear()
+            lost = [request_id for request_id, entry in self.pending.items() if entry[2] == worker_id]
+            entries = [self.pending.pop(request_id) for request_id in lost]
+            self.in_flight[worker_id] = 0
+        for future, slot, _ in entries:
+            INFERENCE_DROPS.inc(reason="worker_died")
+            self.free_slots.put(slot)
+            future.set_result(None)
+
+        INFERENCE_WORKER_RESTARTS.inc()
+        self._start_worker(worker_id)
+
+    def _record_timings(self, payload, timings):
+        if "face_detection" in timings:
+            FACE_DETECTION_SECONDS.observe(timings["face_detection"], backend=self.face_detector)
+        if "inference" in timings:
+            EMOTION_INFERENCE_SECONDS.observe(timings["inference"], backend=self.emotion_backend)
+            FACES_ANALYSED.inc(len(payload[0]), backend=self.emotion_backend)
+
+    def shutdown(self):
+        self.running = False
+        for task_queue in self.task_queues:
+            task_queue.put(None)
+        for worker in self.workers:
+            worker.join(timeout=2)
+        for shm in self.slots:
+            shm.close()
+            shm.unlink()
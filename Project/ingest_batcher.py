@@ -0,0 +1,277 @@
+import queue
+import struct
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, TimeoutError
+import cv2
+import numpy as np
+from emotion_detector import EmotionDetector
+from metrics import registry
+
+INGEST_FRAMES = registry.counter("ingest_frames_total", "Frames uploaded by browser cameras")
+INGEST_REJECTED = registry.counter("ingest_rejected_total", "Uploads answered without analysing them", ["reason"])
+INGEST_BATCH_FACES = registry.histogram("ingest_batch_faces", "Faces per emotion model pass for uploaded frames",
+                                        buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256))
+INGEST_WAIT_SECONDS = registry.histogram("ingest_wait_seconds", "Time uploaded faces waited for their batch to run")
+
+
+def parse_frames(data, max_frames=16):
+    """
+    Split an upload into its JPEG frames. Each frame is a 4-byte big-endian
+    length followed by that many bytes, oldest frame first.
+    Returns: list of bytes; raises ValueError for malformed uploads
+    """
+    frames = []
+    offset = 0
+    while offset < len(data):
+        if len(frames) >= max_frames:
+            raise ValueError(f"More than {max_frames} frames in one upload")
+        if offset + 4 > len(data):
+            raise ValueError("Truncated frame header")
+        (length,) = struct.unpack_from(">I", data, offset)
+        offset += 4
+        if length == 0 or offset + length > len(data):
+            raise ValueError("Truncated frame")
+        frames.append(data[offset:offset + length])
+        offset += length
+    return frames
+
+
+def jpeg_size(data):
+    """
+    Read a JPEG's dimensions from its frame header, without decoding it
+    Returns: (width, height), or None if the data isn't a readable JPEG
+    """
+    if data[:2] != b"\xff\xd8":
+        return None
+    offset = 2
+    while offset + 4 <= len(data):
+        if data[offset] != 0xFF:
+            return None
+        marker = data[offset + 1]
+        if marker == 0xFF:
+            # Fill byte before a marker
+            offset += 1
+            continue
+        if 0xD0 <= marker <= 0xD8 or marker == 0x01:
+            # Markers without a length
+            offset += 2
+            continue
+        (length,) = struct.unpack_from(">H", data, offset + 2)
+        # SOF0-SOF15, except DHT (C4), JPG (C8) and DAC (CC)
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            if offset + 9 > len(data):
+                return None
+            height, width = struct.unpack_from(">HH", data, offset + 5)
+            return width, height
+        offset += 2 + length
+    return None
+
+
+def result_json(result):
+    """
+    JSON-friendly form of one frame's (faces, mood), or None for a frame
+    that couldn't be analysed
+    """
+    if result is None:
+        return None
+    faces, mood = result
+    return {
+        "faces": [{
+            "emotion": face['emotion'],
+            "confidence": round(face['confidence'], 3),
+            "face_coords": [int(v) for v in face['face_coords']]
+        } for face in faces],
+        "mood": {
+            "emotion": mood['emotion'],
+            "confidence": round(mood['confidence'], 3)
+        } if mood else None
+    }
+
+
+class IngestBatcher:
+    """
+    Emotion analysis for frames uploaded by browser cameras, batched across
+    clients.
+
+    Request threads decode their frames and find the faces themselves,
+    each borrowing a face detector from a pool that keeps up to
+    max_detectors idle ones, then queue the face crops. A single
+    worker runs the emotion model on everything queued by every client in
+    one pass, waiting at most max_wait seconds for up to max_batch faces
+    to arrive. Uploads are turned away while more than max_pending faces
+    are waiting. Frames wider or taller than max_dimension are not decoded
+    at all, since a small JPEG can decode to hundreds of megabytes.
+
+    With a fallback_pool (the process pool, whose workers hold the model)
+    each frame is analysed by the pool instead.
+    """
+    def __init__(self, detector, max_batch=64, max_wait=0.01, max_pending=512, result_timeout=10.0,
+                 fallback_pool=None, max_detectors=8, max_dimension=1920):
+        self.detector = detector
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.max_pending = max_pending
+        self.result_timeout = result_timeout
+        self.fallback_pool = fallback_pool
+        self.max_dimension = max_dimension
+
+        # Werkzeug serves every request on a new thread, so per-thread
+        # detectors would be rebuilt for each upload
+        self.detectors = queue.Queue(maxsize=max_detectors)
+        self.condition = threading.Condition()
+        self.jobs = deque()
+        self.pending_faces = 0
+        self.running = True
+
+        self.worker = threading.Thread(target=self._run, name="ingest-batcher")
+        self.worker.daemon = True
+        self.worker.start()
+
+    def is_ready(self):
+        if self.fallback_pool is not None:
+            return self.fallback_pool.is_ready()
+        return self.detector.is_ready()
+
+    def _acquire_detector(self):
+        try:
+            return self.detectors.get_nowait()
+        except queue.Empty:
+            return EmotionDetector(model=self.detector.model, warm_up=False, background=False,
+                                   face_detector=self.detector.face_detector,
+                                   face_detector_options=self.detector.face_detector_options,
+                                   emotion_backend=self.detector.emotion_backend)
+
+    def _release_detector(self, detector):
+        try:
+            self.detectors.put_nowait(detector)
+        except queue.Full:
+            pass
+
+    def analyze(self, jpegs):
+        """
+        Decode uploaded frames and detect the emotion of every face in them
+        Returns: (faces, mood) per frame, None for frames that couldn't be
+        decoded; None altogether while the model is loading or the batcher
+        is saturated
+        """
+        if not self.is_ready():
+            INGEST_REJECTED.inc(reason="loading")
+            return None
+        INGEST_FRAMES.inc(len(jpegs))
+
+        images = [self.decode(jpeg) for jpeg in jpegs]
+        if self.fallback_pool is not None:
+            return [self.fallback_pool.detect_emotions(image) if image is not None else None for image in images]
+
+        detector = self._acquire_detector()
+        try:
+            return self._analyze_images(detector, images)
+        finally:
+            self._release_detector(detector)
+
+    def decode(self, jpeg):
+        """Decode one uploaded frame; None if it isn't a JPEG or is over max_dimension"""
+        size = jpeg_size(jpeg)
+        if size is None or min(size) == 0 or max(size) > self.max_dimension:
+            INGEST_REJECTED.inc(reason="frame_size")
+            return None
+        return cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+    def _analyze_images(self, detector, images):
+        frame_boxes = []
+        crops = []
+        for image in images:
+            if image is None:
+                frame_boxes.append(None)
+                continue
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            boxes = [tuple(int(v) for v in face) for face in detector.detect_faces(gray, image)]
+            crops.extend(detector.preprocess_face(gray, box) for box in boxes)
+            frame_boxes.append(boxes)
+
+        probabilities = self.classify(np.stack(crops)) if crops else None
+        if crops and probabilities is None:
+            return None
+
+        results = []
+        offset = 0
+        for boxes in frame_boxes:
+            if not boxes:
+                results.append(None if boxes is None else ([], None))
+                continue
+            results.append(detector.build_results(boxes, probabilities[offset:offset + len(boxes)]))
+            offset += len(boxes)
+        return results
+
+    def classify(self, faces):
+        """
+        Queue preprocessed faces for the next batch and wait for them
+        Returns: array of probabilities, or None if the queue is full or the batch timed out
+        """
+        future = Future()
+        with self.condition:
+            if self.pending_faces + len(faces) > self.max_pending:
+                INGEST_REJECTED.inc(reason="busy")
+                return None
+            self.jobs.append((faces, future, time.perf_counter()))
+            self.pending_faces += len(faces)
+            self.condition.notify()
+
+        try:
+            return future.result(self.result_timeout)
+        except TimeoutError:
+            INGEST_REJECTED.inc(reason="timeout")
+            return None
+        except Exception:
+            INGEST_REJECTED.inc(reason="error")
+            return None
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.running and not self.jobs:
+                    self.condition.wait()
+                if not self.running:
+                    return
+
+                # Give other clients until max_wait after the oldest job to join this batch
+                deadline = self.jobs[0][2] + self.max_wait
+                while self.running and self.pending_faces < self.max_batch:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+
+                # Always take the oldest job, even if it alone is over max_batch
+                batch = []
+                count = 0
+                while self.jobs and (not batch or count + len(self.jobs[0][0]) <= self.max_batch):
+                    job = self.jobs.popleft()
+                    batch.append(job)
+                    count += len(job[0])
+                self.pending_faces -= count
+
+            started = time.perf_counter()
+            for _, _, submitted in batch:
+                INGEST_WAIT_SECONDS.observe(started - submitted)
+            INGEST_BATCH_FACES.observe(count)
+
+            try:
+                probabilities = self.detector.predict_emotions(np.concatenate([faces for faces, _, _ in batch]))
+            except Exception as e:
+                print(f"Error in batched emotion detection: {e}")
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            offset = 0
+            for faces, future, _ in batch:
+                future.set_result(probabilities[offset:offset + len(faces)])
+                offset += len(faces)
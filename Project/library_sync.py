@@ -0,0 +1,252 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def slim_track(track):
+    """Keep only the track fields the player uses, to keep the local copy small"""
+    images = track.get('album', {}).get('images') or []
+    return {
+        'id': track.get('id'),
+        'name': track.get('name'),
+        'uri': track.get('uri'),
+        'artists': [{'name': artist.get('name')} for artist in track.get('artists', [])[:1]],
+        'album': {
+            'name': track.get('album', {}).get('name'),
+            'images': images[:1]
+        }
+    }
+
+
+class LibrarySync:
+    """
+    Mirrors the user's playlists and saved tracks into a local JSON file.
+
+    Every page of playlists, playlist items and saved tracks is fetched, with
+    the pages after the first one requested in parallel on a bounded thread
+    pool. Playlists whose snapshot_id hasn't changed since the last sync are
+    not downloaded again, and saved tracks are only read until the first
+    track that is already known. That can't see a liked song being removed
+    while another is added, so the saved tracks are read in full again
+    once the last full read is older than full_sync_interval seconds.
+    """
+    playlist_page_size = 50
+    item_page_size = 100
+    saved_page_size = 50
+    item_fields = "items(track(id,name,uri,type,artists(name),album(name,images))),total"
+
+    def __init__(self, sp, cache_path=".spotify_library.json", max_workers=4, full_sync_interval=86400.0):
+        self.sp = sp
+        self.cache_path = cache_path
+        self.max_workers = max_workers
+        self.full_sync_interval = full_sync_interval
+
+        self.lock = threading.Lock()
+        self.data = self.load()
+
+    def load(self):
+        """Read the last synced library from disk"""
+        empty = {'user_id': None, 'playlists': {}, 'saved_tracks': [], 'synced_at': None,
+                 'saved_full_sync_at': None}
+        if not os.path.exists(self.cache_path):
+            return empty
+        try:
+            with open(self.cache_path) as f:
+                data = json.load(f)
+            for key, value in empty.items():
+                data.setdefault(key, value)
+            return data
+        except Exception as e:
+            print(f"Error reading library cache, starting fresh: {e}")
+            return empty
+
+    def save(self):
+        tmp_path = self.cache_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.data, f)
+        os.replace(tmp_path, self.cache_path)
+
+    def cached_user(self):
+        """Spotify user ID the local copy was synced for, None if unknown"""
+        with self.lock:
+            return self.data['user_id']
+
+    def sync(self, user_id=None):
+        """
+        Bring the local copy up to date with Spotify
+        Returns: the list of synced playlists (id, name, snapshot_id, tracks)
+        """
+        start = time.time()
+
+        with self.lock:
+            if user_id is not None and self.data['user_id'] not in (None, user_id):
+                # Different account, nothing in the cache applies
+                previous_playlists, known_saved, full_sync_at = {}, [], None
+            else:
+                previous_playlists, known_saved = self.data['playlists'], self.data['saved_tracks']
+                full_sync_at = self.data['saved_full_sync_at']
+        # Incremental reads can miss a removed track, so read everything again now and then
+        incremental = full_sync_at is not None and time.time() - full_sync_at < self.full_sync_interval
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            playlists = self._fetch_playlists(executor)
+            if playlists is None:
+                print("Could not list playlists, keeping the previously synced library")
+                with self.lock:
+                    return list(self.data['playlists'].values())
+
+            changed = [p for p in playlists
+                       if p['id'] not in previous_playlists
+                       or previous_playlists[p['id']].get('snapshot_id') != p['snapshot_id']]
+            changed_ids = {p['id'] for p in changed}
+
+            synced = {p['id']: previous_playlists[p['id']] for p in playlists if p['id'] not in changed_ids}
+            for playlist, tracks, complete in self._fetch_playlist_tracks(executor, changed):
+                if not complete and playlist['id'] in previous_playlists:
+                    # Keep what we had rather than a partial copy
+                    tracks = previous_playlists[playlist['id']]['tracks']
+                synced[playlist['id']] = {
+                    'id': playlist['id'],
+                    'name': playlist['name'],
+                    # A partially fetched playlist is retried on the next sync
+                    'snapshot_id': playlist['snapshot_id'] if complete else None,
+                    'tracks': tracks
+                }
+
+            saved_tracks, full_read = self._sync_saved_tracks(executor, known_saved, incremental)
+            if full_read:
+                full_sync_at = time.time()
+
+        with self.lock:
+            self.data = {
+                'user_id': user_id,
+                'playlists': synced,
+                'saved_tracks': saved_tracks,
+                'synced_at': time.time(),
+                'saved_full_sync_at': full_sync_at
+            }
+            try:
+                self.save()
+            except Exception as e:
+                print(f"Error writing library cache: {e}")
+
+        print(f"Library sync: {len(playlists)} playlists ({len(changed)} changed), "
+              f"{len(saved_tracks)} saved tracks in {time.time() - start:.1f}s")
+        return [synced[p['id']] for p in playlists]
+
+    def playlist_tracks(self, playlist_id):
+        with self.lock:
+            playlist = self.data['playlists'].get(playlist_id)
+            return list(playlist['tracks']) if playlist else []
+
+    def saved_tracks(self):
+        with self.lock:
+            return list(self.data['saved_tracks'])
+
+    def _fetch_remaining(self, executor, fetch_page, first_pages, page_size):
+        """
+        Given the first page of several listings, fetch all remaining pages
+        of all of them in one parallel batch
+        Returns: (items, complete) per listing, in order
+        """
+        items = [list(page.get('items') or []) if page else [] for page in first_pages]
+        complete = [page is not None for page in first_pages]
+
+        jobs = [(index, offset)
+                for index, page in enumerate(first_pages) if page
+                for offset in range(page_size, page.get('total') or 0, page_size)]
+        pages = executor.map(lambda job: fetch_page(job[0], job[1]), jobs)
+        for (index, _), page in zip(jobs, pages):
+            if page is None:
+                complete[index] = False
+            elif page.get('items'):
+                items[index].extend(page['items'])
+
+        return list(zip(items, complete))
+
+    def _fetch_playlists(self, executor):
+        def fetch_page(_, offset):
+            try:
+                return self.sp.current_user_playlists(limit=self.playlist_page_size, offset=offset)
+            except Exception as e:
+                print(f"Error fetching playlists at offset {offset}: {e}")
+                return None
+
+        first_page = fetch_page(0, 0)
+        if first_page is None:
+            return None
+        [(items, _)] = self._fetch_remaining(executor, fetch_page, [first_page], self.playlist_page_size)
+        return [{'id': p['id'], 'name': p['name'], 'snapshot_id': p.get('snapshot_id')}
+                for p in items if p and p.get('id')]
+
+    def _fetch_playlist_tracks(self, executor, playlists):
+        def fetch_page(index, offset):
+            try:
+                return self.sp.playlist_items(
+                    playlists[index]['id'],
+                    fields=self.item_fields,
+                    limit=self.item_page_size,
+                    offset=offset,
+                    additional_types=("track",)
+                )
+            except Exception as e:
+                print(f"Error syncing playlist '{playlists[index]['name']}' at offset {offset}: {e}")
+                return None
+
+        first_pages = list(executor.map(lambda index: fetch_page(index, 0), range(len(playlists))))
+        results = self._fetch_remaining(executor, fetch_page, first_pages, self.item_page_size)
+
+        for playlist, (items, complete) in zip(playlists, results):
+            tracks = [slim_track(item['track']) for item in items
+                      if item.get('track') and item['track'].get('uri')
+                      and item['track'].get('type', 'track') == 'track']
+            yield playlist, tracks, complete
+
+    def _sync_saved_tracks(self, executor, known, incremental=True):
+        """
+        Read the saved tracks, only the new ones on top of known if incremental
+        Returns: (tracks, whether the whole library was read)
+        """
+        def fetch_page(_, offset):
+            try:
+                return self.sp.current_user_saved_tracks(limit=self.saved_page_size, offset=offset)
+            except Exception as e:
+                print(f"Error fetching saved tracks at offset {offset}: {e}")
+                return None
+
+        known_uris = {track['uri'] for track in known}
+
+        if known and incremental:
+            # Saved tracks come newest first, so only read until the first known one
+            new_tracks = []
+            offset = 0
+            total = None
+            while True:
+                page = fetch_page(0, offset)
+                if page is None:
+                    return known, False
+                total = page.get('total')
+                reached_known = False
+                for item in page.get('items') or []:
+                    track = item.get('track')
+                    if not track or not track.get('uri'):
+                        continue
+                    if track['uri'] in known_uris:
+                        reached_known = True
+                        break
+                    new_tracks.append(slim_track(track))
+                if reached_known or not page.get('next'):
+                    break
+                offset += self.saved_page_size
+
+            merged = new_tracks + known
+            if total is not None and len(merged) == total:
+                return merged, False
+            # Tracks were removed since the last sync, read the whole library again
+
+        [(items, complete)] = self._fetch_remaining(executor, fetch_page, [fetch_page(0, 0)], self.saved_page_size)
+        if not complete and known:
+            return known, False
+        return [slim_track(item['track']) for item in items if item.get('track') and item['track'].get('uri')], complete
@@ -0,0 +1,253 @@
+"""
+End-to-end load test for MusicPlayer against the local fake Spotify API.
+
+Starts fake_spotify.FakeSpotifyServer (or uses --api-url), builds a
+MusicPlayer pointed at it, and then runs one PlaybackDispatcher per
+simulated session, each submitting emotion switches at random (Poisson)
+intervals. Reports emotion-to-playback latency percentiles, how many
+switches were played, superseded or failed, and how many API calls
+(by endpoint) the library sync and steady-state playback needed, as JSON.
+
+With --check-retry-after it instead checks that a 429 from the fake API
+pauses the client for the Retry-After time it sent, and exits non-zero
+if it doesn't.
+
+Usage:
+    python load_test.py --sessions 4 --rate 0.5 --duration 60 --latency 0.05 --rate-limit 20
+    python load_test.py --check-retry-after 2
+"""
+import argparse
+import contextlib
+import json
+import random
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+import spotipy
+
+from benchmark import percentiles
+from fake_spotify import FakeSpotifyServer, generate_library
+from music_player import MusicPlayer
+from playback_dispatcher import PlaybackDispatcher
+from spotify_client import SPOTIFY_RETRIES, SpotifyClient, create_http_session
+
+EMOTIONS = ["angry", "disgust", "fear", "happy", "sad", "surprise", "neutral"]
+
+
+class SimulatedSession:
+    """
+    One camera session: submits emotion switches to its own playback
+    dispatcher and records how long each one took to start playing
+    """
+    def __init__(self, name, player, rate, rng):
+        self.name = name
+        self.rate = rate
+        self.rng = rng
+        self.player = player
+
+        self.lock = threading.Lock()
+        self.last_submit = None
+        self.submitted = 0
+        self.picked_up = 0
+        self.played = 0
+        self.failed = 0
+        self.latencies = []
+        self.dispatcher = PlaybackDispatcher(self.play)
+
+    def play(self, emotion):
+        # The dispatcher only runs the newest submission, so its submit time is the start
+        with self.lock:
+            submitted_at = self.last_submit
+            self.picked_up += 1
+
+        result = self.player.play_random_track_for_emotion(emotion)
+
+        with self.lock:
+            if result:
+                self.played += 1
+                self.latencies.append(time.perf_counter() - submitted_at)
+            else:
+                self.failed += 1
+        return result
+
+    def run(self, duration):
+        emotion = "neutral"
+        end = time.perf_counter() + duration
+        while True:
+            wait = self.rng.expovariate(self.rate)
+            if time.perf_counter() + wait >= end:
+                break
+            time.sleep(wait)
+
+            emotion = self.rng.choice([e for e in EMOTIONS if e != emotion])
+            with self.lock:
+                self.last_submit = time.perf_counter()
+                self.submitted += 1
+            self.dispatcher.submit(emotion)
+
+    def wait_idle(self, timeout):
+        deadline = time.time() + timeout
+        while not self.dispatcher.is_idle() and time.time() < deadline:
+            time.sleep(0.05)
+        self.dispatcher.stop()
+
+
+def fetch_stats(api_url, reset=False):
+    base = api_url.rstrip("/").rsplit("/v1", 1)[0]
+    stats = requests.get(f"{base}/_stats", timeout=5).json()
+    if reset:
+        requests.post(f"{base}/_reset", timeout=5)
+    return stats
+
+
+def run_load_test(api_url, sessions, rate, duration, sync_timeout, seed, player_options):
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        start = time.perf_counter()
+        player = MusicPlayer(
+            "load-test", "load-test", "http://127.0.0.1/callback",
+            library_cache_path=f"{cache_dir}/library.json",
+            track_index_path=f"{cache_dir}/track_index.db",
+            api_url=api_url,
+            access_token="load-test",
+            **player_options
+        )
+        ready_seconds = time.perf_counter() - start
+
+        # Audio features are indexed in the background after the sync
+        deadline = time.time() + sync_timeout
+        while not len(player.track_index) and time.time() < deadline:
+            time.sleep(0.1)
+        time.sleep(0.5)
+        sync_seconds = time.perf_counter() - start
+        sync_stats = fetch_stats(api_url, reset=True)
+        retries_before = sum(SPOTIFY_RETRIES.values.values())
+
+        simulated = [SimulatedSession(f"session-{i}", player, rate, random.Random(rng.random()))
+                     for i in range(sessions)]
+        threads = [threading.Thread(target=session.run, args=(duration,), name=session.name)
+                   for session in simulated]
+        run_start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for session in simulated:
+            session.wait_idle(timeout=30)
+        run_seconds = time.perf_counter() - run_start
+
+        play_stats = fetch_stats(api_url)
+        player.track_index.close()
+
+    latencies = [latency for session in simulated for latency in session.latencies]
+    submitted = sum(session.submitted for session in simulated)
+    picked_up = sum(session.picked_up for session in simulated)
+    played = sum(session.played for session in simulated)
+
+    return {
+        "sessions": sessions,
+        "switch_rate_per_session": rate,
+        "duration_seconds": round(run_seconds, 2),
+        "startup": {
+            "ready_seconds": round(ready_seconds, 3),
+            "indexed_seconds": round(sync_seconds, 3),
+            "indexed_tracks": len(player.track_index),
+            "api_calls": sync_stats["calls"],
+            "total_api_calls": sync_stats["total_calls"]
+        },
+        "switches": {
+            "submitted": submitted,
+            "played": played,
+            "failed": sum(session.failed for session in simulated),
+            "superseded": submitted - picked_up
+        },
+        "emotion_to_playback": percentiles(latencies),
+        "api_calls": play_stats["calls"],
+        "total_api_calls": play_stats["total_calls"],
+        "api_calls_per_playback": round(play_stats["total_calls"] / played, 2) if played else None,
+        "api_errors": play_stats["errors"],
+        "client_retries": sum(SPOTIFY_RETRIES.values.values()) - retries_before
+    }
+
+
+def check_retry_after(retry_after, tolerance=0.5):
+    """
+    Send two calls to a fake API that allows one call per second; the
+    second gets a 429 and should succeed after waiting Retry-After seconds
+    Returns: report dict, with "ok" saying whether the pause matched
+    """
+    server = FakeSpotifyServer(rate_limit=1, retry_after=retry_after).start()
+    try:
+        sp = spotipy.Spotify(auth="load-test", requests_session=create_http_session())
+        sp.prefix = server.url.rstrip("/") + "/"
+        client = SpotifyClient(sp, rate=100.0, burst=100)
+
+        client.devices()
+        start = time.perf_counter()
+        client.devices()
+        paused = time.perf_counter() - start
+        rate_limited = sum(count for (status, _), count in server.errors.items() if status == 429)
+    finally:
+        server.stop()
+
+    return {
+        "retry_after": retry_after,
+        "paused_seconds": round(paused, 3),
+        "rate_limited_calls": rate_limited,
+        "ok": rate_limited == 1 and retry_after <= paused <= retry_after + tolerance
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test MusicPlayer against a local fake Spotify API")
+    parser.add_argument("--api-url", help="Use an already running fake API instead of starting one")
+    parser.add_argument("--sessions", type=int, default=4, help="Simulated camera sessions sharing one player")
+    parser.add_argument("--rate", type=float, default=0.5, help="Emotion switches per second per session")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to generate switches for")
+    parser.add_argument("--sync-timeout", type=float, default=60.0, help="Seconds to wait for the library index")
+    parser.add_argument("--latency", type=float, default=0.05, help="Fake API latency per call in seconds")
+    parser.add_argument("--jitter", type=float, default=0.02, help="Extra random fake API latency")
+    parser.add_argument("--error-404-rate", type=float, default=0.0, help="Fraction of fake API calls failing with 404")
+    parser.add_argument("--rate-limit", type=int, default=None, help="Fake API calls per second before 429s")
+    parser.add_argument("--client-rate-limit", type=float, default=10.0, help="MusicPlayer's own request budget per second")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout")
+    parser.add_argument("--check-retry-after", type=int, metavar="SECONDS",
+                        help="Only check that a 429 with this Retry-After pauses the client that long")
+    args = parser.parse_args()
+
+    if args.check_retry_after is not None:
+        with contextlib.redirect_stdout(sys.stderr):
+            report = check_retry_after(args.check_retry_after)
+        print(json.dumps(report, indent=2))
+        sys.exit(0 if report["ok"] else 1)
+
+    server = None
+    api_url = args.api_url
+    if api_url is None:
+        server = FakeSpotifyServer(latency=args.latency, jitter=args.jitter, error_404_rate=args.error_404_rate,
+                                   rate_limit=args.rate_limit, library=generate_library(seed=args.seed),
+                                   seed=args.seed).start()
+        api_url = server.url
+
+    # MusicPlayer logs every step; keep stdout for the report
+    with contextlib.redirect_stdout(sys.stderr):
+        report = run_load_test(api_url, args.sessions, args.rate, args.duration, args.sync_timeout, args.seed,
+                               {"rate_limit": args.client_rate_limit})
+    if server is not None:
+        server.stop()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+        print(f"Wrote load test report to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,24 @@
 import spotipy
-from spotipy.oauth2 import SpotifyOAuth, SpotifyClientCredentials
+from spotipy.oauth2 import SpotifyOAuth, SpotifyClientCredentials, SpotifyOauthError
+from spotipy.cache_handler import CacheFileHandler, MemoryCacheHandler
 import random
-import time
-import os
+import secrets
+import threading
+import webbrowser
+from track_cache import TrackPoolCache
+from library_sync import LibrarySync
+from track_index import TrackIndex
+from spotify_client import create_http_session, SpotifyClient, TokenRefresher
+from playback_queue import DeviceCache, PlaybackQueue
 
 class MusicPlayer:
-    def __init__(self, client_id, client_secret, redirect_uri):
+    def __init__(self, client_id, client_secret, redirect_uri, track_cache_ttl=600.0, track_pool_size=200,
+                 library_cache_path=".spotify_library.json", sync_workers=4, library_full_sync_interval=86400.0,
+                 track_index_path=".track_index.db", index_candidates=50, background=False,
+                 connect_timeout=30.0, token_cache_path=".spotify_cache", http_pool_size=10,
+                 request_timeout=5.0, token_refresh_margin=300.0, rate_limit=10.0, rate_burst=20,
+                 max_retry_after=30.0, api_url=None, access_token=None, queue_length=5, queue_check_interval=30.0,
+                 device_cache_ttl=300.0, device_refresh_interval=60.0, device=None, login_via_app=False):
         # Define all necessary scopes
         self.scopes = [
             "user-read-playback-state",
@@ -22,27 +35,157 @@ class MusicPlayer:
             "user-read-private"
         ]
         
-        # Clear any existing cache
-        if os.path.exists(".spotify_cache"):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.redirect_uri = redirect_uri
+        self.sp = None
+        self.playback_available = False
+        self.user_id = None
+        self.ready_event = threading.Event()
+        self.connect_timeout = connect_timeout
+        self.token_cache_path = token_cache_path
+        self.http_pool_size = http_pool_size
+        self.request_timeout = request_timeout
+        self.token_refresh_margin = token_refresh_margin
+        self.rate_limit = rate_limit
+        self.rate_burst = rate_burst
+        self.max_retry_after = max_retry_after
+        self.api_url = api_url
+        self.access_token = access_token
+        self.device = device
+        self.http_session = None
+        
+        # With login_via_app the web app serves the OAuth redirect itself and
+        # hands it over with complete_login(), since spotipy's own callback
+        # server can't listen on the port the app is using
+        self.login_via_app = login_via_app
+        self.login_state = secrets.token_urlsafe(16)
+        self.login_event = threading.Event()
+        self.login_code = None
+        self.login_error = None
+        self.token_refresher = None
+        
+        # Emotion to audio features mapping for recommendations
+        self.emotion_features = {
+            "angry": {"valence": 0.2, "energy": 0.8, "tempo": 140},
+            "disgust": {"valence": 0.2, "energy": 0.6, "tempo": 120},
+            "fear": {"valence": 0.3, "energy": 0.7, "tempo": 130},
+            "happy": {"valence": 0.8, "energy": 0.7, "tempo": 120},
+            "sad": {"valence": 0.2, "energy": 0.3, "tempo": 90},
+            "surprise": {"valence": 0.6, "energy": 0.8, "tempo": 135},
+            "neutral": {"valence": 0.5, "energy": 0.5, "tempo": 110}
+        }
+        
+        # Define genre seeds for each emotion
+        self.emotion_genres = {
+            "angry": ["metal", "hard-rock", "punk"],
+            "disgust": ["industrial", "metal", "goth"],
+            "fear": ["ambient", "atmospheric", "industrial"],
+            "happy": ["pop", "dance", "disco", "edm"],
+            "sad": ["sad", "acoustic", "piano", "indie"],
+            "surprise": ["edm", "electronic", "dubstep"],
+            "neutral": ["pop", "rock", "indie"]
+        }
+        
+        # Local copy of the user's playlists and saved tracks
+        self.library = LibrarySync(self.sp, cache_path=library_cache_path, max_workers=sync_workers,
+                                   full_sync_interval=library_full_sync_interval)
+        
+        # Audio features of the user's tracks, ranked locally against emotion targets
+        self.track_index = TrackIndex(track_index_path)
+        self.index_candidates = index_candidates
+        
+        # Keep pre-fetched tracks per emotion so picking a track doesn't hit the API
+        self.track_pool = TrackPoolCache(
+            lambda emotion: self.get_tracks_for_emotion(emotion, "index"),
+            ttl=track_cache_ttl,
+            capacity=track_pool_size
+        )
+        
+        self.user_playlists = {}
+        
+        # The playback device is looked up once and kept fresh in the background,
+        # so a track change is a single start_playback call
+        self.devices = DeviceCache(self.get_active_device, ttl=device_cache_ttl,
+                                   refresh_interval=device_refresh_interval)
+        
+        # Each track change queues the next few tracks for the same emotion;
+        # batches the queue starts by itself are reported to the track listeners
+        self.queue_length = max(1, queue_length)
+        self.track_listeners = []
+        self.playback_queue = PlaybackQueue(
+            self.play_tracks,
+            lambda: self.sp.current_playback(),
+            lambda emotion: self.select_tracks(emotion),
+            check_interval=queue_check_interval,
+            on_started=self.on_queue_started
+        )
+        
+        # Authenticating can wait for the user to log in and syncing the
+        # library takes a while, so a server can do both in the background
+        if background:
+            connect_thread = threading.Thread(target=self.connect, name="spotify-connect")
+            connect_thread.daemon = True
+            connect_thread.start()
+        else:
+            self.connect()
+    
+    def connect(self):
+        """Authenticate with Spotify, load the user's playlists and fill the track pools"""
+        try:
+            self.authenticate()
+            self.library.sp = self.sp
+            if self.playback_available:
+                self.devices.start()
+            
+            # Initialize user playlists
+            self.load_user_playlists()
+            
+            if self.sp is not None or len(self.track_index):
+                self.track_pool.prefill(self.emotion_features)
+        finally:
+            self.ready_event.set()
+    
+    def is_ready(self):
+        """Whether authentication and the initial library load have finished"""
+        return self.ready_event.is_set()
+    
+    def authenticate(self):
+        """Log in with OAuth, falling back to Client Credentials (no playback control)"""
+        # Tokens are kept in token_cache_path between runs, so a restart
+        # reuses (or refreshes) the last login instead of opening the browser
+        self.http_session = create_http_session(self.http_pool_size)
+        
+        if self.api_url:
+            # A Spotify-compatible API such as fake_spotify.py, with a fixed token
             try:
-                os.remove(".spotify_cache")
-                print("Removed existing Spotify cache file")
-            except:
-                pass
+                print(f"Using Spotify API at {self.api_url}")
+                self.sp = self.create_client(auth=self.access_token or "local")
+                user = self.sp.current_user()
+                print(f"Successfully authenticated as: {user['display_name']}")
+                self.playback_available = True
+                self.user_id = user['id']
+            except Exception as e:
+                print(f"Could not reach Spotify API at {self.api_url}: {e}")
+                self.sp = None
+            return
         
         # First, try the OAuth flow which allows playback control
         try:
             print("Authenticating with Spotify using OAuth...")
-            self.sp = spotipy.Spotify(
-                auth_manager=SpotifyOAuth(
-                    client_id=client_id,
-                    client_secret=client_secret,
-                    redirect_uri=redirect_uri,
-                    scope=" ".join(self.scopes),
-                    cache_path=".spotify_cache",
-                    open_browser=True
-                )
+            auth_manager = SpotifyOAuth(
+                client_id=self.client_id,
+                client_secret=self.client_secret,
+                redirect_uri=self.redirect_uri,
+                scope=" ".join(self.scopes),
+                cache_handler=CacheFileHandler(cache_path=self.token_cache_path),
+                open_browser=True,
+                requests_session=self.http_session,
+                requests_timeout=self.request_timeout
             )
+            if self.login_via_app and not self.has_cached_login(auth_manager):
+                self.login_through_app(auth_manager)
+            self.sp = self.create_client(auth_manager)
             # Test the connection
             user = self.sp.current_user()
             print(f"Successfully authenticated as: {user['display_name']}")
@@ -53,12 +196,14 @@ class MusicPlayer:
             print("Falling back to Client Credentials flow (no playback control)...")
             # Fall back to Client Credentials flow (no playback control)
             try:
-                self.sp = spotipy.Spotify(
-                    auth_manager=SpotifyClientCredentials(
-                        client_id=client_id,
-                        client_secret=client_secret
-                    )
+                auth_manager = SpotifyClientCredentials(
+                    client_id=self.client_id,
+                    client_secret=self.client_secret,
+                    cache_handler=MemoryCacheHandler(),
+                    requests_session=self.http_session,
+                    requests_timeout=self.request_timeout
                 )
+                self.sp = self.create_client(auth_manager)
                 print("Successfully authenticated with Spotify using Client Credentials")
                 self.playback_available = False
                 self.user_id = None
@@ -67,32 +212,53 @@ class MusicPlayer:
                 self.sp = None
                 self.playback_available = False
                 self.user_id = None
+                return
         
-        # Emotion to audio features mapping for recommendations
-        self.emotion_features = {
-            "angry": {"valence": 0.2, "energy": 0.8, "tempo": 140},
-            "disgust": {"valence": 0.2, "energy": 0.6, "tempo": 120},
-            "fear": {"valence": 0.3, "energy": 0.7, "tempo": 130},
-            "happy": {"valence": 0.8, "energy": 0.7, "tempo": 120},
-            "sad": {"valence": 0.2, "energy": 0.3, "tempo": 90},
-            "surprise": {"valence": 0.6, "energy": 0.8, "tempo": 135},
-            "neutral": {"valence": 0.5, "energy": 0.5, "tempo": 110}
-        }
-        
-        # Define genre seeds for each emotion
-        self.emotion_genres = {
-            "angry": ["metal", "hard-rock", "punk"],
-            "disgust": ["industrial", "metal", "goth"],
-            "fear": ["ambient", "atmospheric", "industrial"],
-            "happy": ["pop", "dance", "disco", "edm"],
-            "sad": ["sad", "acoustic", "piano", "indie"],
-            "surprise": ["edm", "electronic", "dubstep"],
-            "neutral": ["pop", "rock", "indie"]
-        }
+        # Renew the token before it expires instead of on the next API call
+        self.token_refresher = TokenRefresher(auth_manager, margin=self.token_refresh_margin)
+        self.token_refresher.start()
+    
+    @staticmethod
+    def has_cached_login(auth_manager):
+        """Whether the token cache holds a login with every scope we need, refreshing it if expired"""
+        try:
+            return auth_manager.validate_token(auth_manager.cache_handler.get_cached_token()) is not None
+        except SpotifyOauthError:
+            return False
+    
+    def login_through_app(self, auth_manager):
+        """Send the user to Spotify's login page and wait for the app's /callback route to receive the code"""
+        url = auth_manager.get_authorize_url(state=self.login_state)
+        print(f"Log in to Spotify to enable playback: {url}")
+        try:
+            webbrowser.open(url)
+        except webbrowser.Error:
+            pass
         
-        # Initialize user playlists
-        self.user_playlists = {}
-        self.load_user_playlists()
+        self.login_event.wait()
+        if self.login_error:
+            raise SpotifyOauthError(f"Login failed: {self.login_error}", error=self.login_error)
+        auth_manager.get_access_token(self.login_code, as_dict=False, check_cache=False)
+    
+    def complete_login(self, state, code=None, error=None):
+        """
+        Hand over the parameters Spotify redirected the browser to /callback with
+        Returns: whether the login was started by this player
+        """
+        if self.login_event.is_set() or not secrets.compare_digest(state or "", self.login_state):
+            return False
+        self.login_code = code
+        self.login_error = error or (None if code else "no code received")
+        self.login_event.set()
+        return True
+    
+    def create_client(self, auth_manager=None, auth=None):
+        """Spotify client sharing the pooled session, with rate limiting and retries"""
+        sp = spotipy.Spotify(auth=auth, auth_manager=auth_manager, requests_session=self.http_session,
+                             requests_timeout=self.request_timeout)
+        if self.api_url:
+            sp.prefix = self.api_url.rstrip('/') + '/'
+        return SpotifyClient(sp, rate=self.rate_limit, burst=self.rate_burst, max_retry_after=self.max_retry_after)
     
     def load_user_playlists(self):
         """Load and categorize user playlists for emotions"""
@@ -102,9 +268,12 @@ class MusicPlayer:
             
         try:
             print("Loading user playlists...")
-            results = self.sp.current_user_playlists(limit=50)
+            # Neither the library cache nor the track index carry over to another account
+            self.track_index.set_user(self.user_id, assumed_owner=self.library.cached_user())
+            # Sync every playlist, only downloading the ones that changed
+            playlists = self.library.sync(self.user_id)
             
-            if not results or 'items' not in results or not results['items']:
+            if not playlists:
                 print("No playlists found")
                 return
                 
@@ -120,7 +289,7 @@ class MusicPlayer:
             }
             
             # Assign playlists to emotions based on name matching
-            for playlist in results['items']:
+            for playlist in playlists:
                 name = playlist['name'].lower()
                 
                 for emotion, keywords in emotion_keywords.items():
@@ -136,24 +305,54 @@ class MusicPlayer:
                 if emotion not in self.user_playlists or not self.user_playlists[emotion]:
                     self.user_playlists[emotion] = []
                     # Use the first few playlists as fallbacks
-                    for i in range(min(3, len(results['items']))):
-                        self.user_playlists[emotion].append(results['items'][i]['id'])
+                    for i in range(min(3, len(playlists))):
+                        self.user_playlists[emotion].append(playlists[i]['id'])
             
             print(f"Loaded playlists for {len(self.user_playlists)} emotion categories")
+            
+            # Index the synced tracks and fetch missing audio features in the background
+            indexer = threading.Thread(target=self.index_library, args=(playlists,))
+            indexer.daemon = True
+            indexer.start()
         except Exception as e:
             print(f"Error loading user playlists: {e}")
     
+    def index_library(self, playlists):
+        """Add synced tracks to the local index and download their audio features"""
+        try:
+            for playlist in playlists:
+                self.track_index.add_tracks(playlist['tracks'])
+            self.track_index.add_tracks(self.library.saved_tracks())
+            
+            updated = self.track_index.update_features(self.sp)
+            print(f"Track index: {len(self.track_index)} tracks with audio features ({updated} new)")
+            
+            if updated:
+                # Refill the pools from the now mood-aware index
+                self.track_pool.clear()
+                self.track_pool.prefill(self.emotion_features)
+        except Exception as e:
+            print(f"Error indexing library: {e}")
+    
     def get_tracks_for_emotion(self, emotion, method="playlist"):
         """
         Get a list of tracks based on the emotion
-        method: 'playlist', 'library', or 'features'
+        method: 'index', 'playlist', 'library', or 'features'
         """
+        if emotion not in self.emotion_features:
+            emotion = "neutral"  # Default to neutral if emotion not recognized
+        
+        if method == "index":
+            # Rank the local catalogue against the emotion's target features, no API call needed
+            tracks = self.track_index.nearest(self.emotion_features[emotion], k=self.index_candidates)
+            if tracks:
+                print(f"Found {len(tracks)} tracks in local index for emotion: {emotion}")
+                return tracks
+            return self.get_tracks_for_emotion(emotion, "playlist")
+        
         if self.sp is None:
             print("Spotify client is not initialized")
             return []
-            
-        if emotion not in self.emotion_features:
-            emotion = "neutral"  # Default to neutral if emotion not recognized
         
         if method == "playlist" and self.user_id is not None:
             # Get tracks from user's playlists
@@ -167,32 +366,20 @@ class MusicPlayer:
                 # Select a random playlist from the emotion category
                 playlist_id = random.choice(self.user_playlists[emotion])
                 
-                # Try up to 3 times to get the playlist tracks (handling intermittent 404s)
-                max_retries = 3
-                for attempt in range(max_retries):
-                    try:
-                        results = self.sp.playlist_tracks(playlist_id, limit=50)
-                        
-                        if not results or 'items' not in results:
-                            print(f"No tracks found in playlist (attempt {attempt+1}/{max_retries})")
-                            time.sleep(1)  # Wait before retry
-                            continue
-                            
-                        tracks = results['items']
-                        print(f"Found {len(tracks)} tracks in playlist")
-                        
-                        valid_tracks = [track['track'] for track in tracks if track['track'] is not None]
-                        if valid_tracks:
-                            print(f"Returning {len(valid_tracks)} valid tracks")
-                            return valid_tracks
-                        else:
-                            print("No valid tracks found, trying another method")
-                    except Exception as e:
-                        print(f"Error getting playlist tracks (attempt {attempt+1}/{max_retries}): {e}")
-                        time.sleep(1)  # Wait before retry
+                # Use the synced copy of the playlist when we have one
+                synced_tracks = self.library.playlist_tracks(playlist_id)
+                if synced_tracks:
+                    print(f"Returning {len(synced_tracks)} tracks from synced playlist")
+                    return synced_tracks
                 
-                # If we get here, all attempts failed
-                print("All playlist attempts failed, trying library instead")
+                # Rate limits and server errors are retried by the client itself
+                results = self.sp.playlist_tracks(playlist_id, limit=50)
+                valid_tracks = [item['track'] for item in (results or {}).get('items', []) if item['track'] is not None]
+                if valid_tracks:
+                    print(f"Returning {len(valid_tracks)} valid tracks")
+                    return valid_tracks
+                
+                print("No valid tracks found in playlist, trying library instead")
                 return self.get_tracks_for_emotion(emotion, "library")
             except Exception as e:
                 print(f"Error getting tracks from playlist: {e}")
@@ -202,6 +389,13 @@ class MusicPlayer:
             # Get tracks from user's saved tracks
             try:
                 print(f"Getting tracks from user's library for emotion: {emotion}")
+                
+                # Use the synced copy of the library when we have one
+                synced_tracks = self.library.saved_tracks()
+                if synced_tracks:
+                    print(f"Found {len(synced_tracks)} tracks in synced library")
+                    return synced_tracks
+                
                 results = self.sp.current_user_saved_tracks(limit=50)
                 
                 if not results or 'items' not in results:
@@ -227,35 +421,17 @@ class MusicPlayer:
                 target_features = self.emotion_features[emotion]
                 seed_genres = self.emotion_genres[emotion]
                 
-                # Try up to 3 times to get recommendations (handling intermittent 404s)
-                max_retries = 3
-                for attempt in range(max_retries):
-                    try:
-                        # Get recommendations based on features
-                        results = self.sp.recommendations(
-                            seed_genres=seed_genres[:min(3, len(seed_genres))],
-                            target_valence=target_features['valence'],
-                            target_energy=target_features['energy'],
-                            limit=50
-                        )
-                        
-                        if not results or 'tracks' not in results:
-                            print(f"No tracks found from recommendations (attempt {attempt+1}/{max_retries})")
-                            time.sleep(1)  # Wait before retry
-                            continue
-                            
-                        tracks = results['tracks']
-                        print(f"Found {len(tracks)} tracks from recommendations")
-                        
-                        if tracks:
-                            return tracks
-                    except Exception as e:
-                        print(f"Error getting recommendations (attempt {attempt+1}/{max_retries}): {e}")
-                        time.sleep(1)  # Wait before retry
+                # Get recommendations based on features
+                results = self.sp.recommendations(
+                    seed_genres=seed_genres[:min(3, len(seed_genres))],
+                    target_valence=target_features['valence'],
+                    target_energy=target_features['energy'],
+                    limit=50
+                )
                 
-                # If we reached here, all attempts failed
-                print("All recommendation attempts failed, returning empty list")
-                return []
+                tracks = (results or {}).get('tracks') or []
+                print(f"Found {len(tracks)} tracks from recommendations")
+                return tracks
             except Exception as e:
                 print(f"Error getting tracks based on features: {e}")
                 return []
@@ -265,7 +441,8 @@ class MusicPlayer:
     
     def get_active_device(self):
         """
-        Get the first available active device
+        Get the configured device (by name or ID), otherwise the first
+        available active device
         """
         if not self.playback_available:
             print("Playback control not available with current authentication")
@@ -282,7 +459,13 @@ class MusicPlayer:
             # Find active device or use the first one
             active_devices = [d for d in devices['devices'] if d.get('is_active', False)]
             
-            if active_devices:
+            if self.device:
+                matching = [d for d in devices['devices'] if self.device in (d['id'], d['name'])]
+                if not matching:
+                    print(f"Device '{self.device}' not found. Please open Spotify on it.")
+                    return None
+                device = matching[0]
+            elif active_devices:
                 device = active_devices[0]
             else:
                 device = devices['devices'][0]
@@ -307,76 +490,124 @@ class MusicPlayer:
                 'image': track['album']['images'][0]['url'] if track['album']['images'] else None,
                 'uri': track['uri']
             }
-            
-        try:
-            # Get available device
-            device_id = self.get_active_device()
-            
+        
+        print(f"Playing track: {track['name']} by {track['artists'][0]['name']}")
+        return self.play_tracks([track['uri']])
+    
+    def play_tracks(self, uris):
+        """
+        Replace what's playing with these tracks, in order, on the cached device.
+        If Spotify rejects the command the device is looked up again and the
+        command retried once, since the device has usually gone away.
+        """
+        for attempt in range(2):
+            device_id = self.devices.get() if attempt == 0 else self.devices.refresh()
             if not device_id:
                 print("No active device available for playback")
                 return False
             
-            # Play the track - try up to 3 times
-            max_retries = 3
-            for attempt in range(max_retries):
-                try:
-                    print(f"Playing track: {track['name']} by {track['artists'][0]['name']} (attempt {attempt+1}/{max_retries})")
-                    self.sp.start_playback(device_id=device_id, uris=[track['uri']])
-                    return True
-                except Exception as e:
-                    print(f"Error playing track (attempt {attempt+1}/{max_retries}): {e}")
-                    if attempt < max_retries - 1:
-                        time.sleep(1)  # Wait before retry
-            
-            return False
-        except Exception as e:
-            print(f"Error playing track: {e}")
-            return False
+            try:
+                self.sp.start_playback(device_id=device_id, uris=uris)
+                return True
+            except Exception as e:
+                print(f"Error playing track: {e}")
+                self.devices.invalidate()
+        return False
+    
+    def add_track_listener(self, callback):
+        """Call callback(emotion, track_info) whenever the playback queue starts a new batch itself"""
+        self.track_listeners.append(callback)
+    
+    def on_queue_started(self, emotion, tracks):
+        info = self.track_info(tracks[0])
+        print(f"Now playing: {info['name']}")
+        for callback in list(self.track_listeners):
+            callback(emotion, info)
+    
+    @staticmethod
+    def track_info(track):
+        """
+        The track details shown on the page
+        Returns: dict with name, artist, album, image and uri
+        """
+        return {
+            'name': track['name'],
+            'artist': track['artists'][0]['name'],
+            'album': track['album']['name'],
+            'image': track['album']['images'][0]['url'] if track['album']['images'] else None,
+            'uri': track['uri']
+        }
+    
+    def select_tracks(self, emotion, first=None, candidates=None):
+        """
+        Pick up to queue_length distinct tracks for an emotion, starting with first,
+        from candidates or the pre-fetched pool
+        Returns: list of tracks
+        """
+        selected = [first] if first is not None else []
+        seen = {track['uri'] for track in selected}
+        for _ in range(self.queue_length * 2):
+            if len(selected) >= self.queue_length:
+                break
+            track = random.choice(candidates) if candidates else self.track_pool.take(emotion)
+            if track is None:
+                break
+            if track['uri'] not in seen:
+                seen.add(track['uri'])
+                selected.append(track)
+        return selected
     
-    def play_random_track_for_emotion(self, emotion, method="playlist"):
+    def play_random_track_for_emotion(self, emotion, method="index"):
         """
         Play a random track matching the detected emotion
         """
         print(f"\n--- Finding music for emotion: {emotion} ---")
-        tracks = self.get_tracks_for_emotion(emotion, method)
+        # Called from the playback worker, so it can wait for a background login
+        if not self.ready_event.wait(timeout=self.connect_timeout):
+            print("Spotify is still connecting, not playing anything yet")
+            return None
         
-        if not tracks:
-            print(f"No tracks found for emotion: {emotion}")
-            # Try other methods if the first one fails
-            if method == "playlist":
-                return self.play_random_track_for_emotion(emotion, "library")
-            elif method == "library":
-                return self.play_random_track_for_emotion(emotion, "features")
-            else:
-                return None
+        if emotion not in self.emotion_features:
+            emotion = "neutral"  # Default to neutral if emotion not recognized
+        
+        # Pick from the pre-fetched pool first, only going to the API on a miss
+        track = self.track_pool.take(emotion) if method == "index" else None
+        tracks = None
         
-        # Select a random track
-        track = random.choice(tracks)
+        if track is None:
+            tracks = self.get_tracks_for_emotion(emotion, method)
+            
+            if not tracks:
+                print(f"No tracks found for emotion: {emotion}")
+                # Try other methods if the first one fails
+                if method in ("index", "playlist"):
+                    return self.play_random_track_for_emotion(emotion, "library")
+                elif method == "library":
+                    return self.play_random_track_for_emotion(emotion, "features")
+                else:
+                    return None
+            
+            self.track_pool.put(emotion, tracks)
+            
+            # Select a random track
+            track = random.choice(tracks)
         print(f"Selected track: {track['name']} by {track['artists'][0]['name']}")
         
         # Play the track or just return track info if playback not available
         if self.playback_available:
-            success = self.play_track(track)
+            # Start the track with the next few queued behind it, in one call
+            upcoming = self.select_tracks(emotion, track, tracks)
+            print(f"Playing track: {track['name']} by {track['artists'][0]['name']} "
+                  f"({len(upcoming) - 1} more queued)")
+            success = self.playback_queue.start(emotion, upcoming)
             
             if success:
                 print(f"Now playing: {track['name']}")
-                return {
-                    'name': track['name'],
-                    'artist': track['artists'][0]['name'],
-                    'album': track['album']['name'],
-                    'image': track['album']['images'][0]['url'] if track['album']['images'] else None,
-                    'uri': track['uri']
-                }
+                return self.track_info(track)
             else:
                 print("Failed to play track")
                 return None
         else:
             # Return track info without playing
             print(f"Playback not available, but would play: {track['name']}")
-            return {
-                'name': track['name'],
-                'artist': track['artists'][0]['name'],
-                'album': track['album']['name'],
-                'image': track['album']['images'][0]['url'] if track['album']['images'] else None,
-                'uri': track['uri']
-            }
\ No newline at end of file
+            return self.track_info(track)
\ No newline at end of file
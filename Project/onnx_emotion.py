@@ -0,0 +1,127 @@
+"""
+ONNX Runtime backend for the emotion classifier.
+
+The DeepFace emotion model is a small CNN, but loading it pulls in all of
+TensorFlow. This module exports it once to ONNX, optionally quantizes the
+weights to int8, and runs it with ONNX Runtime on the CPU. OnnxEmotionModel
+has the same predict_on_batch() interface as the Keras model, so
+EmotionDetector can use either one.
+
+Export (needs deepface, tf2onnx and onnxruntime, only on the machine doing the export):
+    python onnx_emotion.py models/emotion.onnx
+
+This writes models/emotion.onnx and models/emotion_int8.onnx and prints how
+closely both match the original model and how fast they are.
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+
+FACE_SIZE = 48
+
+
+class OnnxEmotionModel:
+    """
+    Emotion classifier running in ONNX Runtime
+    Input: float32 batch of shape (N, 48, 48, 1) scaled to [0, 1]
+    Output: (N, 7) probabilities in DeepFace's emotion order
+    """
+    def __init__(self, model_path, threads=None):
+        if not os.path.exists(model_path):
+            raise ValueError(f"ONNX emotion model not found: {model_path}")
+
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        self.model_path = model_path
+
+    def predict_on_batch(self, batch):
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        return self.session.run(None, {self.input_name: batch})[0]
+
+
+def export_emotion_model(output_path, quantize=True):
+    """
+    Convert the DeepFace emotion model to ONNX, and to int8 if quantize is set
+    Returns: (float model path, quantized model path or None)
+    """
+    import tensorflow as tf
+    import tf2onnx
+    from deepface import DeepFace
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    model = DeepFace.build_model("Emotion")
+    signature = (tf.TensorSpec((None, FACE_SIZE, FACE_SIZE, 1), tf.float32, name="face"),)
+    tf2onnx.convert.from_keras(model, input_signature=signature, opset=13, output_path=output_path)
+
+    quantized_path = None
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        root, ext = os.path.splitext(output_path)
+        quantized_path = f"{root}_int8{ext}"
+        # Weights are stored as int8; activations are quantized on the fly,
+        # so no calibration images are needed
+        quantize_dynamic(output_path, quantized_path, weight_type=QuantType.QInt8)
+
+    return output_path, quantized_path
+
+
+def compare_models(reference, candidates, samples=256, batch_size=8, seed=0):
+    """
+    Run the reference model and each candidate on the same random faces
+    Returns: dict of name -> max probability error, top-1 agreement and ms per batch
+    """
+    rng = np.random.default_rng(seed)
+    faces = rng.random((samples, FACE_SIZE, FACE_SIZE, 1), dtype=np.float32)
+    batches = [faces[i:i + batch_size] for i in range(0, samples, batch_size)]
+
+    def run(model):
+        model.predict_on_batch(batches[0])
+        start = time.perf_counter()
+        output = np.concatenate([np.asarray(model.predict_on_batch(batch)) for batch in batches])
+        return output, (time.perf_counter() - start) * 1000.0 / len(batches)
+
+    expected, reference_ms = run(reference)
+    report = {"reference": {"ms_per_batch": round(reference_ms, 3)}}
+    for name, model in candidates.items():
+        output, ms = run(model)
+        report[name] = {
+            "max_error": round(float(np.abs(output - expected).max()), 5),
+            "top1_agreement": round(float((output.argmax(axis=1) == expected.argmax(axis=1)).mean()), 4),
+            "ms_per_batch": round(ms, 3)
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the DeepFace emotion model to ONNX")
+    parser.add_argument("output", nargs="?", default="models/emotion.onnx", help="Path of the float ONNX model")
+    parser.add_argument("--no-quantize", action="store_true", help="Skip writing the int8 model")
+    parser.add_argument("--no-verify", action="store_true", help="Skip comparing the exported models to DeepFace")
+    args = parser.parse_args()
+
+    float_path, quantized_path = export_emotion_model(args.output, quantize=not args.no_quantize)
+    print(f"Wrote {float_path}")
+    if quantized_path:
+        print(f"Wrote {quantized_path}")
+
+    if not args.no_verify:
+        from deepface import DeepFace
+
+        candidates = {"onnx": OnnxEmotionModel(float_path)}
+        if quantized_path:
+            candidates["onnx_int8"] = OnnxEmotionModel(quantized_path)
+        for name, result in compare_models(DeepFace.build_model("Emotion"), candidates).items():
+            print(f"{name}: {result}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+import threading
+from metrics import registry
+
+PLAYBACK_SECONDS = registry.histogram("playback_seconds", "Time from picking up an emotion to the track starting")
+PLAYBACK_SUPERSEDED = registry.counter("playback_superseded_total",
+                                       "Queued playback commands replaced by a newer emotion before they ran")
+
+
+class PlaybackDispatcher:
+    """
+    Runs playback commands on a dedicated worker thread so callers never
+    wait on Spotify.
+
+    Commands are coalesced: only the most recently submitted emotion is kept,
+    so a burst of emotion switches while a track is being started results in
+    a single follow-up request for the latest emotion.
+    """
+    def __init__(self, play, on_result=None):
+        self.play = play
+        self.on_result = on_result
+
+        self.condition = threading.Condition()
+        self.pending = None
+        self.running = True
+        self.busy = False
+
+        self.worker = threading.Thread(target=self._run, name="playback-dispatcher")
+        self.worker.daemon = True
+        self.worker.start()
+
+    def submit(self, emotion):
+        """Queue playback for an emotion, replacing any command not yet started"""
+        with self.condition:
+            if self.pending is not None:
+                PLAYBACK_SUPERSEDED.inc()
+            self.pending = emotion
+            self.condition.notify()
+
+    def is_idle(self):
+        with self.condition:
+            return self.pending is None and not self.busy
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.pending = None
+            self.condition.notify()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.running and self.pending is None:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                emotion = self.pending
+                self.pending = None
+                self.busy = True
+
+            try:
+                with PLAYBACK_SECONDS.time():
+                    result = self.play(emotion)
+                if self.on_result is not None:
+                    self.on_result(emotion, result)
+            except Exception as e:
+                print(f"Error in playback for {emotion}: {e}")
+            finally:
+                with self.condition:
+                    self.busy = False
@@ -0,0 +1,196 @@
+import threading
+import time
+
+
+class DeviceCache:
+    """
+    Remembers which Spotify device to play on, so starting playback doesn't
+    need a devices() round-trip first. While playback is in use the entry is
+    refreshed in the background; a failed playback command should call
+    invalidate() so the next one looks the device up again.
+
+    fetch() returns a device ID or None.
+    """
+    def __init__(self, fetch, ttl=300.0, refresh_interval=60.0, idle_timeout=600.0):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval
+        self.idle_timeout = idle_timeout
+
+        self.lock = threading.Lock()
+        self.device_id = None
+        self.fetched_at = 0.0
+        self.last_used = 0.0
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def get(self):
+        """Cached device ID, looking it up only if there is none or it is too old"""
+        with self.lock:
+            now = time.time()
+            self.last_used = now
+            if self.device_id is not None and now - self.fetched_at < self.ttl:
+                return self.device_id
+        return self.refresh()
+
+    def refresh(self):
+        device_id = self.fetch()
+        with self.lock:
+            self.device_id = device_id
+            self.fetched_at = time.time() if device_id else 0.0
+        return device_id
+
+    def invalidate(self):
+        with self.lock:
+            self.device_id = None
+            self.fetched_at = 0.0
+
+    def start(self):
+        """Look the device up now and keep it fresh in the background"""
+        if self.thread is not None and self.thread.is_alive():
+            return
+        with self.lock:
+            self.last_used = time.time()
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name="device-cache")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _run(self):
+        delay = 0.0
+        while not self.stop_event.wait(delay):
+            delay = self.refresh_interval
+            with self.lock:
+                # Nobody has played anything for a while, stop polling Spotify
+                if time.time() - self.last_used > self.idle_timeout:
+                    continue
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Error refreshing playback device: {e}")
+
+
+class PlaybackQueue:
+    """
+    Keeps Spotify playing music for the current emotion.
+
+    start() replaces whatever is playing with a single start_playback call
+    carrying the chosen track followed by the next few, so playback carries
+    on when the first track ends. A monitor thread checks every
+    check_interval seconds and, when the last of those tracks is about to
+    end, starts a fresh batch for the same emotion.
+
+    play(uris) starts playback and returns True on success,
+    current_playback() returns Spotify's playback state and
+    select_tracks(emotion) returns the next tracks to play.
+    on_started(emotion, tracks), if given, is called for every batch the
+    monitor starts by itself. The monitor ends once playback stops or moves
+    to something else, and start() begins a new one.
+    """
+    def __init__(self, play, current_playback, select_tracks, check_interval=30.0, on_started=None):
+        self.play = play
+        self.current_playback = current_playback
+        self.select_tracks = select_tracks
+        self.check_interval = check_interval
+        self.on_started = on_started
+
+        self.lock = threading.Lock()
+        self.start_lock = threading.Lock()
+        self.emotion = None
+        self.uris = []
+        self.generation = 0
+        self.wake = threading.Event()
+        self.running = True
+        self.monitor = None
+
+    def start(self, emotion, tracks, generation=None):
+        """
+        Play these tracks now, in order; returns whether playback started.
+        With generation, only if no other batch has started since then.
+        """
+        uris = [track['uri'] for track in tracks]
+        if not uris:
+            return False
+
+        # Serialises playback commands, so a refill for an old emotion can't
+        # start after a newer batch
+        with self.start_lock:
+            if generation is not None and generation != self.generation:
+                return False
+            if not self.play(uris):
+                return False
+
+            with self.lock:
+                self.emotion = emotion
+                self.uris = uris
+                self.generation += 1
+                if self.monitor is None or not self.monitor.is_alive():
+                    self.monitor = threading.Thread(target=self._monitor, name="playback-queue")
+                    self.monitor.daemon = True
+                    self.monitor.start()
+        self.wake.set()
+        return True
+
+    def stop(self):
+        self.running = False
+        self.wake.set()
+
+    def _finish(self, generation):
+        """Forget the batch and end the monitor, unless a new batch just started"""
+        with self.lock:
+            if self.generation != generation:
+                return False
+            self.uris = []
+            self.monitor = None
+            return True
+
+    def _monitor(self):
+        while self.running:
+            # A new batch (or stop) restarts the wait, so track changes don't poll Spotify
+            woken = self.wake.wait(self.check_interval)
+            self.wake.clear()
+            with self.lock:
+                emotion, uris, generation = self.emotion, self.uris, self.generation
+            if woken or not self.running:
+                continue
+
+            try:
+                # None when nothing is playing on any device
+                playback = self.current_playback() or {}
+            except Exception as e:
+                print(f"Error checking playback state: {e}")
+                continue
+
+            item = playback.get('item')
+            if not playback.get('is_playing') or not item or item.get('uri') not in uris:
+                # Stopped, paused or playing something else: the batch is over,
+                # the next emotion change starts a new one
+                if self._finish(generation):
+                    return
+                continue
+            if item.get('uri') != uris[-1]:
+                # Not yet at the last track
+                continue
+
+            remaining = (item.get('duration_ms', 0) - (playback.get('progress_ms') or 0)) / 1000.0
+            if remaining > self.check_interval:
+                continue
+
+            # Wait for the last track to finish, unless the emotion changes first
+            if self.wake.wait(max(remaining - 0.5, 0.0)):
+                continue
+
+            try:
+                tracks = self.select_tracks(emotion)
+                if not tracks:
+                    if self._finish(generation):
+                        return
+                    continue
+                print(f"Queueing {len(tracks)} more tracks for {emotion}")
+                if self.start(emotion, tracks, generation) and self.on_started is not None:
+                    self.on_started(emotion, tracks)
+            except Exception as e:
+                print(f"Error queueing more tracks: {e}")
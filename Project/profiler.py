@@ -0,0 +1,147 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+
+def thread_cpu_ticks():
+    """
+    CPU time (in clock ticks) used so far by each thread of this process,
+    keyed by native thread ID
+    Returns: dict, empty where /proc isn't available
+    """
+    ticks = {}
+    try:
+        task_ids = os.listdir("/proc/self/task")
+    except OSError:
+        return ticks
+
+    for task_id in task_ids:
+        try:
+            with open(f"/proc/self/task/{task_id}/stat") as f:
+                # Fields after the command name; utime and stime are the 14th and 15th
+                fields = f.read().rsplit(")", 1)[1].split()
+            ticks[int(task_id)] = int(fields[11]) + int(fields[12])
+        except (OSError, IndexError, ValueError):
+            continue
+    return ticks
+
+
+class SamplingProfiler:
+    """
+    Opt-in sampling profiler for the running server.
+
+    Every `interval` seconds a background thread records the Python stack
+    of every other thread. With cpu_only (on Linux) a thread's stack is
+    only counted if the thread used CPU since the previous sample, so
+    threads blocked on the camera, a queue or the network don't drown out
+    the ones actually burning CPU.
+
+    Stacks are kept in the collapsed format ("thread;outer;inner count")
+    understood by flamegraph.pl and speedscope.
+    """
+    def __init__(self, interval=0.01, max_depth=64, cpu_only=True):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.cpu_only = cpu_only and os.path.isdir("/proc/self/task")
+
+        self.lock = threading.Lock()
+        self.stacks = Counter()
+        self.samples = 0
+        self.started_at = None
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.last_ticks = {}
+
+    def is_running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, interval=None):
+        """Start sampling, clearing earlier results; returns False if already running"""
+        if self.is_running():
+            return False
+        if interval:
+            self.interval = interval
+
+        with self.lock:
+            self.stacks.clear()
+            self.samples = 0
+        self.started_at = time.time()
+        self.last_ticks = thread_cpu_ticks() if self.cpu_only else {}
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name="sampling-profiler")
+        self.thread.daemon = True
+        self.thread.start()
+        return True
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout=1.0)
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        own_id = threading.get_ident()
+        threads = {thread.ident: thread for thread in threading.enumerate()}
+
+        busy = None
+        if self.cpu_only:
+            ticks = thread_cpu_ticks()
+            busy = {tid for tid, value in ticks.items() if value > self.last_ticks.get(tid, 0)}
+            self.last_ticks = ticks
+
+        collected = []
+        for ident, frame in sys._current_frames().items():
+            if ident == own_id:
+                continue
+            thread = threads.get(ident)
+            if busy is not None and (thread is None or thread.native_id not in busy):
+                continue
+
+            stack = []
+            while frame is not None and len(stack) < self.max_depth:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            name = thread.name if thread is not None else str(ident)
+            collected.append(";".join([name] + stack[::-1]))
+
+        with self.lock:
+            self.stacks.update(collected)
+            self.samples += 1
+
+    def collapsed(self):
+        """Collapsed stacks, most frequent first"""
+        with self.lock:
+            stacks = self.stacks.most_common()
+        return "".join(f"{stack} {count}\n" for stack, count in stacks)
+
+    def summary(self, limit=20):
+        """
+        Functions seen most often at the top of a stack
+        Returns: dict with sampling details and a list of the hottest functions
+        """
+        with self.lock:
+            stacks = list(self.stacks.items())
+            samples = self.samples
+
+        functions = Counter()
+        threads = Counter()
+        for stack, count in stacks:
+            frames = stack.split(";")
+            threads[frames[0]] += count
+            functions[frames[-1]] += count
+
+        return {
+            "running": self.is_running(),
+            "interval": self.interval,
+            "cpu_only": self.cpu_only,
+            "seconds": round(time.time() - self.started_at, 1) if self.started_at else 0.0,
+            "samples": samples,
+            "threads": dict(threads.most_common()),
+            "top_functions": [{"function": name, "samples": count} for name, count in functions.most_common(limit)]
+        }
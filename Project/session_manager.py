@@ -0,0 +1,372 @@
+import cv2
+import json
+import threading
+import time
+from frame_bus import FrameBus
+from detection_state import DetectionResult, DetectionState
+from box_tracker import BoxTracker
+from detection_scheduler import DetectionScheduler
+from emotion_state import EmotionStateMachine
+from playback_dispatcher import PlaybackDispatcher
+from stream_broadcaster import StreamBroadcaster
+from metrics import registry
+
+FRAMES_ANALYSED = registry.counter("frames_analysed_total", "Frames run through face detection and the emotion model",
+                                   ["session"])
+FRAMES_SKIPPED = registry.counter("frames_skipped_total", "Frames the detection scheduler decided not to analyse",
+                                  ["session"])
+FRAMES_DROPPED = registry.counter("frames_dropped_total", "Frames the inference pool dropped without analysing",
+                                  ["session"])
+EMOTION_SWITCHES = registry.counter("emotion_switches_total", "Changes of the settled emotion", ["session", "emotion"])
+
+
+class Session:
+    """
+    One independent pipeline: a camera, its detection loop, emotion state,
+    playback and video stream. Sessions share the emotion model and the
+    inference pool but nothing else.
+
+    A session whose camera_source is None uses the browser's camera: the
+    page uploads frames to /ingest and their results are fed in through
+    ingest(), with no local capture device or detection loop.
+    """
+    def __init__(self, session_id, camera_source, emotion_detector, inference_pool, music_player, config):
+        self.session_id = session_id
+        self.emotion_detector = emotion_detector
+        self.inference_pool = inference_pool
+        self.music_player = music_player
+        self.browser_camera = camera_source is None
+        self.ingest_lock = threading.Lock()
+        self.ingest_seq = 0
+
+        self.frame_bus = FrameBus(
+            camera_source,
+            getattr(config, 'FRAME_BUFFER_SIZE', 4),
+            width=getattr(config, 'CAMERA_WIDTH', None),
+            height=getattr(config, 'CAMERA_HEIGHT', None),
+            fps=getattr(config, 'CAMERA_FPS', None),
+            fourcc=getattr(config, 'CAMERA_FOURCC', None),
+            capture_buffer_size=getattr(config, 'CAMERA_BUFFER_SIZE', None),
+            passthrough=getattr(config, 'CAMERA_PASSTHROUGH', False),
+            decode_scale=getattr(config, 'DETECTION_DECODE_SCALE', 1)
+        )
+        self.current_emotion = "neutral"
+        self.current_track = None
+        self.detection_state = DetectionState()
+        self.detection_scheduler = DetectionScheduler(
+            min_interval=getattr(config, 'DETECTION_MIN_INTERVAL', 0.2),
+            max_interval=getattr(config, 'DETECTION_MAX_INTERVAL', 2.0),
+            max_staleness=config.EMOTION_DETECTION_INTERVAL,
+            scene_threshold=getattr(config, 'SCENE_CHANGE_THRESHOLD', 6.0)
+        )
+        self.emotion_state = EmotionStateMachine(
+            emotion_detector.emotions,
+            initial=self.current_emotion,
+            smoothing=getattr(config, 'EMOTION_SMOOTHING', 2.0),
+            margin=getattr(config, 'EMOTION_SWITCH_MARGIN', 0.15),
+            min_dwell=getattr(config, 'EMOTION_MIN_DWELL', 2.0),
+            min_switch_interval=getattr(config, 'MIN_TRACK_CHANGE_INTERVAL', 10.0)
+        )
+        self.emotion_lock = threading.Lock()
+        # Signalled whenever the emotion or track changes; state_version lets
+        # event stream clients tell whether they have already seen the latest state
+        self.state_changed = threading.Condition(self.emotion_lock)
+        self.state_version = 0
+        self.state_payload = None
+        self.detection_thread = None
+        self.detection_active = False
+
+        # Search around the last face first, with a full-frame scan every few
+        # detections so new faces entering the scene are still picked up
+        self.face_roi = getattr(config, 'FACE_DETECTOR_ROI', True)
+        self.full_scan_every = max(int(getattr(config, 'FACE_DETECTOR_FULL_SCAN_EVERY', 5)), 1)
+
+        self.playback_dispatcher = PlaybackDispatcher(music_player.play_random_track_for_emotion,
+                                                      self.on_track_started)
+        # Batches the player queues by itself when the last track ends
+        music_player.add_track_listener(self.on_track_started)
+
+        self.stream_tracker = BoxTracker()
+        self.tracked_version = -1
+        self.stream_broadcaster = StreamBroadcaster(
+            self.frame_bus,
+            render=self.render_stream_frame,
+            quality=getattr(config, 'STREAM_JPEG_QUALITY', 80),
+            scale=getattr(config, 'STREAM_SCALE', 1.0),
+            max_fps=getattr(config, 'STREAM_MAX_FPS', 15),
+            name=session_id
+        )
+
+        with self.emotion_lock:
+            self.publish_state()
+
+        # Pushed state includes detector_ready, so push it again once the model has loaded
+        if not inference_pool.is_ready():
+            ready_thread = threading.Thread(target=self.publish_when_ready, name=f"ready-{session_id}")
+            ready_thread.daemon = True
+            ready_thread.start()
+
+    def publish_when_ready(self):
+        self.inference_pool.wait_ready()
+        with self.emotion_lock:
+            self.publish_state()
+
+    def start_detection(self):
+        """
+        Start the camera and detection loop; returns False if already running
+        Raises IOError if the camera can't be opened
+        """
+        if self.browser_camera:
+            # Frames come from the browser, there's nothing to open here
+            with self.ingest_lock:
+                if self.detection_active:
+                    return False
+                self.emotion_state.reset(self.current_emotion)
+                self.detection_active = True
+            return True
+
+        if self.detection_thread is not None and self.detection_thread.is_alive():
+            return False
+
+        self.frame_bus.start()
+        self.detection_active = True
+        self.detection_thread = threading.Thread(target=self.detect_emotion_thread,
+                                                 name=f"detection-{self.session_id}")
+        self.detection_thread.daemon = True
+        self.detection_thread.start()
+        return True
+
+    def stop_detection(self):
+        self.detection_active = False
+        self.frame_bus.stop()
+        self.detection_state.clear()
+
+    def is_running(self):
+        if self.browser_camera:
+            return self.detection_active
+        return self.detection_active and self.frame_bus.is_running()
+
+    def detect_emotion_thread(self):
+        last_seq = 0
+        last_face = None
+        detections = 0
+        self.detection_scheduler.reset()
+        self.emotion_state.reset(self.current_emotion)
+        while self.detection_active:
+            if not self.frame_bus.is_running():
+                time.sleep(1)
+                continue
+
+            # Take the newest frame from the bus
+            frame = self.frame_bus.wait_for_frame(last_seq)
+            if frame is None:
+                continue
+            last_seq = frame.seq
+            if frame.image is None:
+                # Corrupt JPEG from the camera
+                continue
+
+            # Skip inference while the scene is unchanged
+            if not self.detection_scheduler.should_run(frame.image):
+                FRAMES_SKIPPED.inc(session=self.session_id)
+                time.sleep(self.detection_scheduler.poll_interval)
+                continue
+
+            # Detect emotion for every face; the largest face is shown in the stream
+            roi = last_face if self.face_roi and detections % self.full_scan_every else None
+            detections += 1
+            result = self.inference_pool.detect_emotions(frame.image, roi)
+            if result is None:
+                # Dropped: the model is still loading or the inference workers are saturated
+                FRAMES_DROPPED.inc(session=self.session_id)
+                continue
+            FRAMES_ANALYSED.inc(session=self.session_id)
+            faces, mood = result
+            emotion, face_coords, confidence = self.apply_result(faces, mood, frame.seq)
+            last_face = face_coords
+            self.detection_scheduler.record(frame.image, emotion, face_coords, confidence)
+
+    def apply_result(self, faces, mood, seq, now=None):
+        """
+        Publish one frame's detection result and switch music once the
+        smoothed emotion has settled
+        Returns: the frame's emotion, largest face box and confidence
+        """
+        if mood:
+            primary = max(faces, key=lambda f: f['face_coords'][2] * f['face_coords'][3])
+            emotion, face_coords, confidence = mood['emotion'], primary['face_coords'], mood['confidence']
+            probabilities = mood['probabilities']
+        else:
+            emotion, face_coords, confidence, probabilities = None, None, 0.0, None
+
+        # Share the result with the video stream
+        self.detection_state.publish(DetectionResult(emotion, face_coords, confidence, seq,
+                                                     probabilities=probabilities))
+
+        if probabilities is not None:
+            # Only switch music once the smoothed emotion has settled
+            new_emotion = self.emotion_state.update(probabilities, now)
+            if new_emotion:
+                EMOTION_SWITCHES.inc(session=self.session_id, emotion=new_emotion)
+                with self.emotion_lock:
+                    self.current_emotion = new_emotion
+                    self.publish_state()
+                # Play appropriate music
+                self.play_music_for_current_emotion()
+        return emotion, face_coords, confidence
+
+    def ingest(self, results, interval=0.0):
+        """
+        Feed in the results for frames uploaded by the browser, oldest
+        first and captured interval seconds apart. Ignored while detection
+        is stopped.
+        """
+        with self.ingest_lock:
+            if not self.detection_active:
+                return
+            now = time.time()
+            for index, result in enumerate(results):
+                if result is None:
+                    continue
+                FRAMES_ANALYSED.inc(session=self.session_id)
+                self.ingest_seq += 1
+                faces, mood = result
+                self.apply_result(faces, mood, self.ingest_seq, now - (len(results) - 1 - index) * interval)
+
+    def info(self):
+        return {
+            "session": self.session_id,
+            "emotion": self.current_emotion,
+            "track": self.current_track,
+            "detector_ready": self.inference_pool.is_ready()
+        }
+
+    def publish_state(self):
+        """
+        Serialise the current state once and wake up event stream clients.
+        Must be called with emotion_lock held.
+        """
+        self.state_version += 1
+        self.state_payload = json.dumps(self.info())
+        self.state_changed.notify_all()
+
+    def play_music_for_current_emotion(self):
+        with self.emotion_lock:
+            emotion = self.current_emotion
+        # Spotify calls happen on the dispatcher's worker, never on this thread
+        self.playback_dispatcher.submit(emotion)
+
+    def on_track_started(self, emotion, track_info):
+        if track_info:
+            with self.emotion_lock:
+                self.current_track = track_info
+                self.publish_state()
+
+    def render_stream_frame(self, bus_frame):
+        """
+        Draw the emotion overlay for the video stream. Only called from the
+        broadcaster's encoder thread, so a single tracker is enough.
+        """
+        # Frames on the bus are shared and read-only, draw on a copy
+        frame = bus_frame.image.copy()
+
+        # Get current emotion to display
+        with self.emotion_lock:
+            emotion_to_display = self.current_emotion
+
+        # Follow the face box published by the detection thread, tracking it
+        # between detections instead of running inference on every frame
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        version, result = self.detection_state.latest()
+        if version != self.tracked_version:
+            self.tracked_version = version
+            self.stream_tracker.reset(gray, result.face_coords if result else None)
+            face_coords = self.stream_tracker.box
+        else:
+            face_coords = self.stream_tracker.update(gray)
+
+        # Draw emotion on frame
+        if emotion_to_display:
+            frame = self.emotion_detector.draw_emotion_on_frame(frame, emotion_to_display, face_coords)
+
+        return frame
+
+    def generate_frames(self):
+        # Every client gets the same encoded bytes, nothing is encoded per viewer
+        return self.stream_broadcaster.stream()
+
+    def generate_events(self, last_version):
+        while True:
+            with self.state_changed:
+                changed = self.state_changed.wait_for(lambda: self.state_version != last_version, timeout=15)
+                version, payload = self.state_version, self.state_payload
+
+            if not changed:
+                # Comment line keeps proxies from closing an idle connection
+                yield ": keep-alive\n\n"
+                continue
+
+            last_version = version
+            yield f"id: {version}\nevent: state\ndata: {payload}\n\n"
+
+
+class SessionManager:
+    """
+    Runs one Session per configured camera, keyed by session ID.
+
+    camera_sources maps session IDs to anything cv2.VideoCapture accepts
+    (a device index or a stream URL), None for the browser's camera, or a
+    dict with that as "camera" and the session's own MusicPlayer options as
+    "player". Sessions are created on first use.
+    player_factory(session_id, player_options) returns the MusicPlayer a
+    session plays to.
+    """
+    def __init__(self, camera_sources, emotion_detector, inference_pool, player_factory, config):
+        entries = {session_id: entry if isinstance(entry, dict) else {"camera": entry}
+                   for session_id, entry in camera_sources.items()}
+        self.camera_sources = {session_id: entry.get("camera") for session_id, entry in entries.items()}
+        self.player_options = {session_id: dict(entry.get("player") or {}) for session_id, entry in entries.items()}
+        self.emotion_detector = emotion_detector
+        self.inference_pool = inference_pool
+        self.player_factory = player_factory
+        self.config = config
+
+        self.lock = threading.Lock()
+        self.sessions = {}
+
+    def get(self, session_id):
+        """
+        Return the session for this ID, creating it if needed
+        Returns: None for IDs without a configured camera
+        """
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is None and session_id in self.camera_sources:
+                session = Session(
+                    session_id,
+                    self.camera_sources[session_id],
+                    self.emotion_detector,
+                    self.inference_pool,
+                    self.player_factory(session_id, self.player_options[session_id]),
+                    self.config
+                )
+                self.sessions[session_id] = session
+            return session
+
+    def is_browser_camera(self, session_id):
+        """Whether this session takes its frames from the browser instead of a local camera"""
+        return session_id in self.camera_sources and self.camera_sources[session_id] is None
+
+    def list(self):
+        with self.lock:
+            started = dict(self.sessions)
+        return [{
+            "session": session_id,
+            "running": session_id in started and started[session_id].is_running()
+        } for session_id in self.camera_sources]
+
+    def stop_all(self):
+        with self.lock:
+            sessions = list(self.sessions.values())
+        for session in sessions:
+            session.stop_detection()
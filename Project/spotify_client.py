@@ -0,0 +1,250 @@
+import random
+import threading
+import time
+import requests
+from concurrent.futures import Future
+from requests.adapters import HTTPAdapter
+from spotipy.exceptions import SpotifyException
+from urllib3.util.retry import Retry
+from metrics import registry
+
+SPOTIFY_REQUEST_SECONDS = registry.histogram("spotify_request_seconds", "Duration of each Spotify API request",
+                                             ["method"])
+SPOTIFY_ERRORS = registry.counter("spotify_errors_total", "Failed Spotify API requests", ["method", "status"])
+SPOTIFY_RETRIES = registry.counter("spotify_retries_total", "Spotify API requests sent again after a failure",
+                                   ["method", "reason"])
+SPOTIFY_COALESCED = registry.counter("spotify_coalesced_total",
+                                     "Calls answered by an identical request already in flight", ["method"])
+
+
+def create_http_session(pool_size=10, retries=3, backoff_factor=0.3):
+    """
+    Build one keep-alive requests.Session for every Spotify call, so
+    connections (and their TLS handshakes) are reused instead of opened
+    per request. pool_size should cover every thread that talks to
+    Spotify at the same time. Only connection failures are retried here;
+    rate limits and server errors are handled by SpotifyClient, so error
+    responses, including 429s and their Retry-After header, reach it as-is.
+    Returns: requests.Session
+    """
+    retry = Retry(total=retries, connect=retries, read=False, status=0, backoff_factor=backoff_factor,
+                  respect_retry_after_header=False, raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class TokenBucket:
+    """
+    Request budget shared by every thread: `rate` requests per second on
+    average with bursts of up to `burst`. pause() stops all requests for a
+    while, e.g. when Spotify answers 429 with a Retry-After header.
+    """
+    def __init__(self, rate=10.0, burst=20):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be sent"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                else:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class SpotifyClient:
+    """
+    Wraps spotipy.Spotify so every call MusicPlayer, LibrarySync and
+    TrackIndex make:
+      - waits for the shared token bucket, keeping us under Spotify's limits
+      - on 429 pauses all requests for the Retry-After time, then retries;
+        a Retry-After longer than max_retry_after is raised to the caller
+        instead, so one long wait doesn't stall every thread
+      - retries server errors and dropped connections with jittered
+        exponential backoff
+      - for read-only calls, shares the result of an identical call that is
+        already in flight instead of sending it again (single-flight)
+    Any other spotipy method or attribute is passed through unchanged.
+    """
+    read_methods = {
+        "current_user", "current_user_playlists", "current_user_saved_tracks", "playlist", "playlist_items",
+        "playlist_tracks", "audio_features", "recommendations", "devices", "current_playback",
+        "currently_playing", "queue", "track", "tracks", "search"
+    }
+    retry_statuses = {500, 502, 503, 504}
+
+    def __init__(self, sp, rate=10.0, burst=20, max_retries=4, backoff_base=0.5, backoff_max=16.0,
+                 max_retry_after=30.0):
+        self.sp = sp
+        self.max_retry_after = max_retry_after
+        self.bucket = TokenBucket(rate, burst)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self.inflight = {}
+        self.inflight_lock = threading.Lock()
+
+    def __getattr__(self, name):
+        attribute = getattr(self.sp, name)
+        if not callable(attribute):
+            return attribute
+
+        def call(*args, **kwargs):
+            if name in self.read_methods:
+                return self._single_flight(name, attribute, args, kwargs)
+            return self._call(name, attribute, args, kwargs)
+        return call
+
+    def _single_flight(self, name, method, args, kwargs):
+        key = repr((name, args, sorted(kwargs.items())))
+        with self.inflight_lock:
+            future = self.inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self.inflight[key] = future
+
+        if not leader:
+            SPOTIFY_COALESCED.inc(method=name)
+            return future.result()
+
+        try:
+            result = self._call(name, method, args, kwargs)
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.inflight_lock:
+                self.inflight.pop(key, None)
+
+    def _call(self, name, method, args, kwargs):
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            except SpotifyException as e:
+                SPOTIFY_ERRORS.inc(method=name, status=e.http_status)
+                retryable = e.http_status == 429 or e.http_status in self.retry_statuses
+                if not retryable or attempt == self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+                if e.http_status == 429:
+                    retry_after = self._retry_after(e)
+                    if retry_after is not None and retry_after > self.max_retry_after:
+                        print(f"Spotify {name} rate limited for {retry_after:.0f}s, not waiting")
+                        raise
+                    # Everyone waits out the Retry-After time, not just this call
+                    delay = retry_after or delay
+                    self.bucket.pause(delay)
+                print(f"Spotify {name} failed (HTTP {e.http_status}), retrying in {delay:.1f}s")
+                SPOTIFY_RETRIES.inc(method=name, reason=e.http_status)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                SPOTIFY_ERRORS.inc(method=name, status=type(e).__name__)
+                if attempt == self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+                print(f"Spotify {name} failed ({type(e).__name__}), retrying in {delay:.1f}s")
+                SPOTIFY_RETRIES.inc(method=name, reason=type(e).__name__)
+            finally:
+                SPOTIFY_REQUEST_SECONDS.observe(time.perf_counter() - start, method=name)
+
+            time.sleep(delay)
+            attempt += 1
+
+    def _backoff(self, attempt):
+        # "Full jitter": a random delay up to the exponential cap, so
+        # retrying threads don't all hit the API again at the same moment
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    @staticmethod
+    def _retry_after(error):
+        headers = getattr(error, "headers", None) or {}
+        try:
+            return float(headers.get("Retry-After"))
+        except (TypeError, ValueError):
+            return None
+
+
+class TokenRefresher:
+    """
+    Refreshes the Spotify access token in the background a little before
+    it expires, so API calls never have to stop and refresh it themselves.
+    Works with any spotipy auth manager that has a cache handler; OAuth
+    tokens are renewed with their refresh token, Client Credentials tokens
+    are simply requested again.
+    """
+    def __init__(self, auth_manager, margin=300.0, retry_interval=30.0):
+        self.auth_manager = auth_manager
+        self.margin = margin
+        self.retry_interval = retry_interval
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name="spotify-token-refresh")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def refresh_if_needed(self):
+        """
+        Refresh the token if it expires within `margin` seconds
+        Returns: seconds until the next check
+        """
+        token = self.auth_manager.cache_handler.get_cached_token()
+        if not token:
+            return self.retry_interval
+
+        remaining = token["expires_at"] - time.time()
+        if remaining > self.margin:
+            return remaining - self.margin
+
+        if token.get("refresh_token"):
+            token = self.auth_manager.refresh_access_token(token["refresh_token"])
+        else:
+            self.auth_manager.get_access_token(as_dict=False, check_cache=False)
+            token = self.auth_manager.cache_handler.get_cached_token()
+        print("Refreshed Spotify access token")
+
+        if not token:
+            return self.retry_interval
+        return max(token["expires_at"] - time.time() - self.margin, self.retry_interval)
+
+    def _run(self):
+        delay = 0.0
+        while not self.stop_event.wait(delay):
+            try:
+                delay = self.refresh_if_needed()
+            except Exception as e:
+                print(f"Error refreshing Spotify token: {e}")
+                delay = self.retry_interval
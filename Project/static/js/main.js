@@ -8,6 +8,15 @@ document.addEventListener('DOMContentLoaded', function() {
     const artistName = document.getElementById('artistName');
     const albumName = document.getElementById('albumName');
     
+    // Session (camera/room) this page controls
+    const sessionQuery = '?session=' + encodeURIComponent(document.body.dataset.session || 'default');
+    
+    // Sessions without a server-side camera use this browser's camera
+    const browserCamera = document.body.dataset.browserCamera === 'true';
+    const ingestWidth = parseInt(document.body.dataset.ingestWidth, 10) || 320;
+    const ingestFps = parseFloat(document.body.dataset.ingestFps) || 4;
+    const ingestBatch = parseInt(document.body.dataset.ingestBatch, 10) || 4;
+    
     // Store the current track to avoid unnecessary updates
     let currentTrackUri = null;
     
@@ -24,66 +33,177 @@ document.addEventListener('DOMContentLoaded', function() {
     
     // Start detection
     startBtn.addEventListener('click', function() {
-        fetch('/start_detection')
+        fetch('/start_detection' + sessionQuery)
             .then(response => response.json())
             .then(data => {
                 console.log('Detection started:', data);
-                startPolling();
+                startUpdates();
+                if (browserCamera) {
+                    startCamera();
+                }
             })
             .catch(error => console.error('Error starting detection:', error));
     });
     
     // Stop detection
     stopBtn.addEventListener('click', function() {
-        fetch('/stop_detection')
+        fetch('/stop_detection' + sessionQuery)
             .then(response => response.json())
             .then(data => {
                 console.log('Detection stopped:', data);
-                stopPolling();
+                stopUpdates();
+                if (browserCamera) {
+                    stopCamera();
+                }
             })
             .catch(error => console.error('Error stopping detection:', error));
     });
     
-    // Poll for updates
+    // Receive updates pushed by the server, falling back to polling
+    // in browsers without EventSource
+    let eventSource = null;
     let pollingInterval = null;
     
-    function startPolling() {
-        if (!pollingInterval) {
+    function startUpdates() {
+        if (window.EventSource) {
+            if (!eventSource) {
+                // EventSource reconnects on its own and resumes from the last event id
+                eventSource = new EventSource('/events' + sessionQuery);
+                eventSource.addEventListener('state', function(event) {
+                    applyInfo(JSON.parse(event.data));
+                });
+            }
+        } else if (!pollingInterval) {
             pollingInterval = setInterval(updateInfo, 1000);
         }
     }
     
-    function stopPolling() {
+    function stopUpdates() {
+        if (eventSource) {
+            eventSource.close();
+            eventSource = null;
+        }
         if (pollingInterval) {
             clearInterval(pollingInterval);
             pollingInterval = null;
         }
     }
     
-    // Update UI with current emotion and track
-    function updateInfo() {
-        fetch('/current_info')
-            .then(response => response.json())
+    // Browser camera: grab small JPEG frames at ingestFps and upload them
+    // ingestBatch at a time, each prefixed with its 4-byte length
+    let cameraStream = null;
+    let captureInterval = null;
+    let pendingFrames = [];
+    let uploading = false;
+    const captureCanvas = document.createElement('canvas');
+    
+    function startCamera() {
+        if (cameraStream || !navigator.mediaDevices) {
+            return;
+        }
+        navigator.mediaDevices.getUserMedia({video: true, audio: false})
+            .then(stream => {
+                cameraStream = stream;
+                const video = document.getElementById('localVideo');
+                video.srcObject = stream;
+                captureInterval = setInterval(() => captureFrame(video), 1000 / ingestFps);
+            })
+            .catch(error => console.error('Error opening camera:', error));
+    }
+    
+    function stopCamera() {
+        if (captureInterval) {
+            clearInterval(captureInterval);
+            captureInterval = null;
+        }
+        if (cameraStream) {
+            cameraStream.getTracks().forEach(track => track.stop());
+            cameraStream = null;
+        }
+        pendingFrames = [];
+    }
+    
+    function captureFrame(video) {
+        if (!video.videoWidth) {
+            return;
+        }
+        // Downscale before encoding; the server only needs enough pixels to find faces
+        captureCanvas.width = Math.min(ingestWidth, video.videoWidth);
+        captureCanvas.height = Math.round(video.videoHeight * captureCanvas.width / video.videoWidth);
+        captureCanvas.getContext('2d').drawImage(video, 0, 0, captureCanvas.width, captureCanvas.height);
+        captureCanvas.toBlob(blob => {
+            if (!blob) {
+                return;
+            }
+            pendingFrames.push(blob);
+            // Keep only the newest frames while an upload is still in flight
+            if (pendingFrames.length > ingestBatch) {
+                pendingFrames.shift();
+            }
+            if (pendingFrames.length >= ingestBatch && !uploading) {
+                uploadFrames(pendingFrames.splice(0));
+            }
+        }, 'image/jpeg', 0.7);
+    }
+    
+    function uploadFrames(blobs) {
+        uploading = true;
+        Promise.all(blobs.map(blob => blob.arrayBuffer()))
+            .then(buffers => {
+                const total = buffers.reduce((sum, buffer) => sum + 4 + buffer.byteLength, 0);
+                const body = new Uint8Array(total);
+                const view = new DataView(body.buffer);
+                let offset = 0;
+                buffers.forEach(buffer => {
+                    view.setUint32(offset, buffer.byteLength);
+                    body.set(new Uint8Array(buffer), offset + 4);
+                    offset += 4 + buffer.byteLength;
+                });
+                return fetch('/ingest' + sessionQuery + '&interval=' + (1 / ingestFps), {
+                    method: 'POST',
+                    headers: {'Content-Type': 'application/octet-stream'},
+                    body: body
+                });
+            })
+            .then(response => response.ok ? response.json() : null)
             .then(data => {
-                // Update emotion display
-                if (data.emotion) {
-                    emotionText.textContent = data.emotion.charAt(0).toUpperCase() + data.emotion.slice(1);
-                    emotionText.style.color = emotionColors[data.emotion] || '#e0e0e0';
-                }
-                
-                // Update track info
-                if (data.track && data.track.uri !== currentTrackUri) {
-                    currentTrackUri = data.track.uri;
-                    
-                    trackName.textContent = data.track.name;
-                    artistName.textContent = data.track.artist;
-                    albumName.textContent = data.track.album;
-                    
-                    if (data.track.image) {
-                        albumArt.src = data.track.image;
-                    }
+                if (data && data.emotion) {
+                    applyInfo({emotion: data.emotion});
                 }
             })
+            .catch(error => console.error('Error uploading frames:', error))
+            .finally(() => {
+                uploading = false;
+            });
+    }
+    
+    // Fetch the current emotion and track once
+    function updateInfo() {
+        fetch('/current_info' + sessionQuery)
+            .then(response => response.json())
+            .then(applyInfo)
             .catch(error => console.error('Error getting current info:', error));
     }
+    
+    // Update UI with current emotion and track
+    function applyInfo(data) {
+        // Update emotion display
+        if (data.emotion) {
+            emotionText.textContent = data.emotion.charAt(0).toUpperCase() + data.emotion.slice(1);
+            emotionText.style.color = emotionColors[data.emotion] || '#e0e0e0';
+        }
+        
+        // Update track info
+        if (data.track && data.track.uri !== currentTrackUri) {
+            currentTrackUri = data.track.uri;
+            
+            trackName.textContent = data.track.name;
+            artistName.textContent = data.track.artist;
+            albumName.textContent = data.track.album;
+            
+            if (data.track.image) {
+                albumArt.src = data.track.image;
+            }
+        }
+    }
 });
\ No newline at end of file
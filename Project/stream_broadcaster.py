@@ -0,0 +1,126 @@
+import cv2
+import numpy as np
+import threading
+import time
+from metrics import registry
+
+STREAM_ENCODE_SECONDS = registry.histogram("stream_encode_seconds", "Time to JPEG-encode one video feed frame",
+                                           ["stream"])
+
+
+class StreamBroadcaster:
+    """
+    Encodes each camera frame to JPEG once and fans the same bytes out to
+    every /video_feed subscriber.
+
+    A single encoder thread runs while at least one client is connected.
+    It takes frames from the frame bus, lets `render` draw the overlay,
+    optionally downscales, and encodes at the configured quality, never
+    faster than max_fps. When the camera is off a pre-encoded placeholder
+    is sent instead. Frames the camera delivered as JPEG (frame bus
+    passthrough) are forwarded as they are, without an overlay.
+    """
+    boundary = b'--frame\r\nContent-Type: image/jpeg\r\n\r\n'
+
+    def __init__(self, frame_bus, render=None, quality=80, scale=1.0, max_fps=15,
+                 placeholder_size=(640, 480), placeholder_interval=1.0, name="default"):
+        self.frame_bus = frame_bus
+        self.name = name
+        self.render = render
+        self.quality = quality
+        self.scale = scale
+        self.max_fps = max_fps
+        self.placeholder_interval = placeholder_interval
+
+        # The blank frame never changes, so encode it just once
+        width, height = placeholder_size
+        self.placeholder = self.encode(255 * np.ones(shape=[height, width, 3], dtype=np.uint8), scale=1.0)
+
+        self.condition = threading.Condition()
+        self.part = None
+        self.seq = 0
+        self.subscribers = 0
+        self.encoder_thread = None
+
+    def encode(self, image, scale=None):
+        """Encode an image as one multipart chunk of the MJPEG stream"""
+        scale = self.scale if scale is None else scale
+        if scale != 1.0:
+            image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        _, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, int(self.quality)])
+        return self.boundary + buffer.tobytes() + b'\r\n'
+
+    def stream(self):
+        """
+        Generator for one subscriber, yielding each encoded chunk once
+        """
+        with self.condition:
+            self.subscribers += 1
+            if self.encoder_thread is None or not self.encoder_thread.is_alive():
+                self.encoder_thread = threading.Thread(target=self._encode_loop, name="stream-encoder")
+                self.encoder_thread.daemon = True
+                self.encoder_thread.start()
+
+        last_seq = -1
+        try:
+            while True:
+                with self.condition:
+                    # Nothing to send until the encoder has published a chunk
+                    if not self.condition.wait_for(lambda: self.part is not None and self.seq != last_seq,
+                                                   timeout=1.0):
+                        continue
+                    last_seq, part = self.seq, self.part
+                yield part
+        finally:
+            with self.condition:
+                self.subscribers -= 1
+
+    def _publish(self, part):
+        with self.condition:
+            self.part = part
+            self.seq += 1
+            self.condition.notify_all()
+
+    def _encode_loop(self):
+        last_frame_seq = 0
+        last_encode = 0.0
+        last_placeholder = 0.0
+
+        while True:
+            with self.condition:
+                if self.subscribers == 0:
+                    self.encoder_thread = None
+                    return
+
+            if not self.frame_bus.is_running():
+                # Re-send the pre-encoded placeholder now and then for new
+                # viewers, while checking often for the camera to start
+                if time.time() - last_placeholder >= self.placeholder_interval:
+                    self._publish(self.placeholder)
+                    last_placeholder = time.time()
+                time.sleep(0.1)
+                continue
+
+            # Respect the frame rate cap before picking up the newest frame
+            if self.max_fps:
+                wait = last_encode + 1.0 / self.max_fps - time.time()
+                if wait > 0:
+                    time.sleep(wait)
+
+            frame = self.frame_bus.wait_for_frame(last_frame_seq)
+            if frame is None:
+                continue
+            last_frame_seq = frame.seq
+            last_encode = time.time()
+
+            try:
+                if frame.jpeg is not None:
+                    # Already compressed by the camera, nothing to decode or encode
+                    self._publish(self.boundary + frame.jpeg + b'\r\n')
+                    continue
+                image = self.render(frame) if self.render is not None else frame.image
+                with STREAM_ENCODE_SECONDS.time(stream=self.name):
+                    part = self.encode(image)
+                self._publish(part)
+            except Exception as e:
+                print(f"Error encoding stream frame: {e}")
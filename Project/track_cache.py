@@ -0,0 +1,104 @@
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class TrackPoolCache:
+    """
+    Per-emotion pools of pre-fetched tracks.
+
+    Each pool is kept in least-recently-used order: picking a track moves it
+    to the back, and when a pool grows past `capacity` the least recently
+    used tracks are evicted. Entries expire after `ttl` seconds. Whenever a
+    pool runs low on fresh tracks (or is getting old) it is refilled in the
+    background with `fetch_tracks(emotion)`, so picking never waits on the
+    network unless the pool is completely empty.
+    """
+    def __init__(self, fetch_tracks, ttl=600.0, capacity=200, low_water=10, workers=2):
+        self.fetch_tracks = fetch_tracks
+        self.ttl = ttl
+        self.capacity = capacity
+        self.low_water = low_water
+
+        self.lock = threading.Lock()
+        self.pools = {}
+        self.filled_at = {}
+        self.refilling = set()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="track-refill")
+
+    def take(self, emotion):
+        """
+        Pick a track for the emotion from memory
+        Returns: a track, or None if the pool has nothing fresh
+        """
+        now = time.time()
+        with self.lock:
+            pool = self._fresh_pool(emotion, now)
+            track = None
+            if pool:
+                # Prefer the least recently used half so tracks don't repeat back to back
+                uris = list(pool.keys())
+                uri = random.choice(uris[:max(1, len(uris) // 2)])
+                track, fetched_at = pool.pop(uri)
+                pool[uri] = (track, fetched_at)
+
+            needs_refill = len(pool) < self.low_water or now - self.filled_at.get(emotion, 0) > self.ttl / 2
+
+        if needs_refill:
+            self.refill_async(emotion)
+        return track
+
+    def put(self, emotion, tracks):
+        """Add freshly fetched tracks to an emotion's pool"""
+        now = time.time()
+        with self.lock:
+            pool = self.pools.setdefault(emotion, OrderedDict())
+            for track in tracks:
+                if not track or not track.get('uri'):
+                    continue
+                pool[track['uri']] = (track, now)
+
+            while len(pool) > self.capacity:
+                pool.popitem(last=False)
+            self.filled_at[emotion] = now
+
+    def refill_async(self, emotion):
+        """Schedule a background refill unless one is already running"""
+        with self.lock:
+            if emotion in self.refilling:
+                return
+            self.refilling.add(emotion)
+        self.executor.submit(self._refill, emotion)
+
+    def prefill(self, emotions):
+        for emotion in emotions:
+            self.refill_async(emotion)
+
+    def size(self, emotion):
+        with self.lock:
+            return len(self.pools.get(emotion, ()))
+
+    def clear(self):
+        with self.lock:
+            self.pools.clear()
+            self.filled_at.clear()
+
+    def _refill(self, emotion):
+        try:
+            tracks = self.fetch_tracks(emotion)
+            if tracks:
+                self.put(emotion, tracks)
+        except Exception as e:
+            print(f"Error refilling track pool for {emotion}: {e}")
+        finally:
+            with self.lock:
+                self.refilling.discard(emotion)
+
+    def _fresh_pool(self, emotion, now):
+        pool = self.pools.setdefault(emotion, OrderedDict())
+        expired = [uri for uri, (_, fetched_at) in pool.items() if now - fetched_at > self.ttl]
+        for uri in expired:
+            del pool[uri]
+        return pool
@@ -0,0 +1,171 @@
+import sqlite3
+import threading
+import numpy as np
+
+
+class TrackIndex:
+    """
+    Local index of the user's tracks and their audio features.
+
+    Track metadata and features are stored in SQLite so they survive
+    restarts and work offline. Tracks with features are also kept as a
+    NumPy matrix so a whole catalogue can be ranked against an emotion's
+    target features in a single vectorized operation.
+
+    Like LibrarySync's cache, the index belongs to one Spotify account:
+    set_user() empties it when a different account logs in.
+    """
+    feature_names = ["valence", "energy", "tempo"]
+    # Tempo is in BPM, scale it to roughly the same 0-1 range as the others
+    feature_scale = np.array([1.0, 1.0, 1.0 / 200.0], dtype=np.float32)
+    feature_weights = np.array([1.0, 1.0, 0.5], dtype=np.float32)
+    features_batch_size = 100
+
+    def __init__(self, db_path=".track_index.db"):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS tracks (
+                uri TEXT PRIMARY KEY,
+                id TEXT,
+                name TEXT,
+                artist TEXT,
+                album TEXT,
+                image TEXT,
+                valence REAL,
+                energy REAL,
+                tempo REAL,
+                features_checked INTEGER DEFAULT 0
+            )
+        """)
+        self.db.execute("CREATE INDEX IF NOT EXISTS tracks_id ON tracks (id)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.db.commit()
+
+        # (tracks, feature matrix), replaced as a whole so readers never see
+        # a matrix that doesn't line up with the track list
+        self.snapshot = ([], np.zeros((0, len(self.feature_names)), dtype=np.float32))
+        self.reload()
+
+    def __len__(self):
+        return len(self.snapshot[0])
+
+    def set_user(self, user_id, assumed_owner=None):
+        """
+        Record which account the index belongs to, emptying it first if it
+        was built for a different one. assumed_owner is taken as the owner
+        of an index that hasn't recorded one, e.g. the library cache's account.
+        Returns: whether the index was cleared
+        """
+        with self.lock:
+            row = self.db.execute("SELECT value FROM meta WHERE key = 'user_id'").fetchone()
+            owner = row[0] if row is not None else assumed_owner
+            cleared = owner is not None and owner != user_id
+            if cleared:
+                self.db.execute("DELETE FROM tracks")
+            self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('user_id', ?)", (user_id,))
+            self.db.commit()
+        if cleared:
+            print("Track index belongs to a different Spotify account, starting a new one")
+            self.reload()
+        return cleared
+
+    def add_tracks(self, tracks):
+        """Add track metadata; tracks already in the index are left untouched"""
+        rows = []
+        for track in tracks:
+            if not track or not track.get('uri') or not track.get('id'):
+                continue
+            images = track.get('album', {}).get('images') or []
+            rows.append((
+                track['uri'],
+                track['id'],
+                track.get('name'),
+                track['artists'][0]['name'] if track.get('artists') else None,
+                track.get('album', {}).get('name'),
+                images[0]['url'] if images else None
+            ))
+
+        with self.lock:
+            self.db.executemany(
+                "INSERT OR IGNORE INTO tracks (uri, id, name, artist, album, image) VALUES (?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            self.db.commit()
+
+    def update_features(self, sp):
+        """
+        Download audio features for tracks that don't have them yet, in
+        batches of 100 ids per request
+        Returns: number of tracks that received features
+        """
+        with self.lock:
+            ids = [row[0] for row in self.db.execute("SELECT id FROM tracks WHERE features_checked = 0")]
+
+        updated = 0
+        for start in range(0, len(ids), self.features_batch_size):
+            batch = ids[start:start + self.features_batch_size]
+            try:
+                features = sp.audio_features(batch)
+            except Exception as e:
+                print(f"Error getting audio features: {e}")
+                break
+
+            rows = []
+            for track_id, feature in zip(batch, features or []):
+                if feature:
+                    rows.append((feature.get('valence'), feature.get('energy'), feature.get('tempo'), track_id))
+                    updated += 1
+                else:
+                    rows.append((None, None, None, track_id))
+
+            with self.lock:
+                self.db.executemany(
+                    "UPDATE tracks SET valence = ?, energy = ?, tempo = ?, features_checked = 1 WHERE id = ?",
+                    rows
+                )
+                self.db.commit()
+
+        if updated:
+            self.reload()
+        return updated
+
+    def reload(self):
+        """Rebuild the in-memory feature matrix from the database"""
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT uri, name, artist, album, image, valence, energy, tempo FROM tracks "
+                "WHERE valence IS NOT NULL AND energy IS NOT NULL AND tempo IS NOT NULL"
+            ).fetchall()
+
+        tracks = [{
+            'name': name,
+            'uri': uri,
+            'artists': [{'name': artist}],
+            'album': {'name': album, 'images': [{'url': image}] if image else []}
+        } for uri, name, artist, album, image, _, _, _ in rows]
+        matrix = np.array([row[5:] for row in rows], dtype=np.float32).reshape(-1, len(self.feature_names))
+
+        self.snapshot = (tracks, matrix * self.feature_scale)
+
+    def nearest(self, target, k=50):
+        """
+        Rank every indexed track by weighted distance to the target features
+        target: dict with valence, energy and tempo
+        Returns: up to k closest tracks, best first
+        """
+        tracks, matrix = self.snapshot
+        if not tracks or k <= 0:
+            return []
+
+        point = np.array([target[name] for name in self.feature_names], dtype=np.float32) * self.feature_scale
+        distances = (np.square(matrix - point) * self.feature_weights).sum(axis=1)
+
+        k = min(k, len(tracks))
+        closest = np.argpartition(distances, k - 1)[:k]
+        closest = closest[np.argsort(distances[closest])]
+        return [tracks[i] for i in closest]
+
+    def close(self):
+        with self.lock:
+            self.db.close()